@@ -0,0 +1,271 @@
+#Headless benchmark for namedcontrollers - measures what the library costs per FreePIE frame.
+#
+#Drives a WarthogThrottle and a WarthogStick from synthetic input, through workloads modelled on example_FreePie.py, and reports
+#the mean and 99th percentile cost of a frame, how far each frame pushes up the memory in use, and how long the controllers take to build and
+#how much memory each of their controls holds.
+#
+#	python benchmark.py						#run everything, and compare against benchmark_baseline.json if there is one
+#	python benchmark.py --save-baseline		#run everything, and store the results as the new baseline
+#	python benchmark.py --frames 20000 --profile buttons --workload example
+#
+#Needs CPython 3.9 or later (for tracemalloc.reset_peak).
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import namedcontrollers
+
+
+class SyntheticDevice(object):
+	#Stands in for a FreePIE joystick, with the same getDown/getPressed/axes/sliders/pov surface
+
+	def __init__(self):
+		self.buttonBits=0
+		self.previousButtonBits=0
+		self.x=0
+		self.y=0
+		self.z=0
+		self.zRotation=0
+		self.sliders=[0,0]
+		self.pov=[-1,-1,-1,-1]
+
+	def getDown(self,id):
+		return self.buttonBits>>id & 1 == 1
+
+	def getPressed(self,id):
+		return (self.buttonBits & ~self.previousButtonBits)>>id & 1 == 1
+
+	def setButton(self,id,down):
+		if down:
+			self.buttonBits|=1<<id
+		else:
+			self.buttonBits&=~(1<<id)
+
+
+#Input profiles - each is a generator that changes the devices a little, once per frame
+
+def buttonMashingProfile(throttleDevice,stickDevice,seed=1):
+	#a few random buttons pressed or released every frame, on both devices
+	rng=random.Random(seed)
+	while True:
+		for device,buttonCount in ((throttleDevice,32),(stickDevice,19)):
+			device.previousButtonBits=device.buttonBits
+			for i in range(rng.randint(0,3)):
+				id=rng.randrange(buttonCount)
+				device.setButton(id,not device.getDown(id))
+		yield
+
+def toggleFlippingProfile(throttleDevice,stickDevice,seed=1):
+	#now and then, move one of the throttle's toggles to another of its positions
+	rng=random.Random(seed)
+	toggles=list(namedcontrollers.WarthogThrottle.toggles.values())
+	while True:
+		throttleDevice.previousButtonBits=throttleDevice.buttonBits
+		if rng.random()<0.2:
+			definition=rng.choice(toggles)
+			state=rng.choice(list(definition.keys()))
+			for friendlyButtonID in definition:
+				if friendlyButtonID:
+					throttleDevice.setButton(friendlyButtonID-1,friendlyButtonID==state)
+		yield
+
+def axisSweepProfile(throttleDevice,stickDevice,seed=1):
+	#every axis, slider and hat moving continuously
+	frame=0
+	while True:
+		frame+=1
+		for device in (throttleDevice,stickDevice):
+			device.x=int(1000*math.sin(frame/50.0))
+			device.y=int(1000*math.cos(frame/70.0))
+			device.z=int(1000*math.sin(frame/90.0))
+			device.zRotation=int(1000*math.cos(frame/110.0))
+			device.sliders[0]=int(1000*math.sin(frame/130.0))
+			device.pov[0]=-1 if frame%400<100 else (frame//50%8)*4500
+		yield
+
+profiles={
+	'buttons': buttonMashingProfile,
+	'toggles': toggleFlippingProfile,
+	'axes': axisSweepProfile,
+}
+
+
+#Workloads - each is one frame of a user script
+
+def watch(value):
+	#stands in for FreePIE's diagnostics.watch
+	pass
+
+def exampleWorkload(throttle,stick):
+	#the same reads as example_FreePie.py
+	watch(throttle.toggles.apu() )
+	watch(throttle.toggles.eac() )
+	watch(throttle.toggles.eng_fuel_l() )
+	watch(throttle.toggles.engine_right_oper() )
+	watch(throttle.toggles.flaps() )
+
+	watch(throttle.axes.left() )
+	watch(throttle.axes.slider() )
+
+	watch(throttle.hats.coolie() )
+	watch(throttle.hats.coolie.getRawValue() )
+
+	watch(throttle.hats.mic() )
+	watch(throttle.hats.mic.getRawValue() )
+
+	watch(stick.buttons.trigger() )
+	watch(stick.buttons.thumbtrigger.activatedOnce() )
+
+	watch(throttle.buttons.autopilot() )
+	watch(throttle.buttons.autopilot.getTimeSinceLastStateChange() )
+	watch(throttle.buttons.autopilot.getTimeSinceLastPress() )
+	watch(throttle.buttons.autopilot.getTimeSinceLastRelease() )
+	watch(throttle.buttons.autopilot.getDurationOfMostRecentPressedState() )
+	watch(throttle.buttons.autopilot.getDurationOfMostRecentReleasedState() )
+	watch(throttle.buttons.autopilot.pressedFor(3) )
+	watch(throttle.buttons.autopilot.heldFor(10) )
+
+	watch(throttle.buttons.eac.printMorseLog() )
+	watch(throttle.buttons.eac.checkMorseLog('...') )
+	watch(throttle.buttons.eac() )
+	watch(throttle.buttons.eac.getTimeSinceLastStateChange() )
+	watch(throttle.buttons.eac.getPressesLog() )
+	watch(throttle.buttons.eac.getReleasesLog() )
+
+	pressDurationsLog=throttle.buttons.eac.pressDurationsLog
+	watch(len(pressDurationsLog)>3 and pressDurationsLog[-3]>1 and pressDurationsLog[-2]>1 and pressDurationsLog[-1]>1)
+
+def rulesWorkload(throttle,stick):
+	#a long chain of conditions, like a real binding script
+	if throttle.toggles.eac()=='ARM' and throttle.toggles.rdraltm()=='NRM' and throttle.buttons.autopilot():
+		watch('eject')
+	for name in ('speedbrake','boatswitch','china','flaps','autopilotmode','pinky','eng_oper_l','eng_oper_r'):
+		watch(getattr(throttle.toggles,name)() )
+	for name in ('h2u','h2r','h2d','h2l','h3u','h3r','h3d','h3l','h4u','h4r','h4d','h4l','h4p'):
+		watch(getattr(stick.buttons,name)() )
+	for pattern in ('..','...','.-.','--'):
+		watch(throttle.buttons.china_forward.checkMorseLog(pattern) )
+
+workloads={
+	'example': exampleWorkload,
+	'rules': rulesWorkload,
+}
+
+
+def runBenchmark(profileName,workloadName,frames=10000,poll=True):
+	throttleDevice=SyntheticDevice()
+	stickDevice=SyntheticDevice()
+	#the controllers run on virtual time, stepped at 250Hz, so timing-based logic behaves the same on every run
+	virtualClock=namedcontrollers.VirtualClock()
+	throttle=namedcontrollers.WarthogThrottle(throttleDevice,clock=virtualClock)
+	stick=namedcontrollers.WarthogStick(stickDevice,clock=virtualClock)
+	profile=profiles[profileName](throttleDevice,stickDevice)
+	workload=workloads[workloadName]
+	clock=time.perf_counter
+
+	def frame():
+		virtualClock.advance(1/250.0)
+		if poll:
+			throttle.poll()
+			stick.poll()
+		workload(throttle,stick)
+
+	#warm up, so that every control has been created before we start measuring
+	for i in range(100):
+		next(profile)
+		frame()
+
+	frameTimes=[]
+	for i in range(frames):
+		next(profile)
+		startTime=clock()
+		frame()
+		frameTimes.append(clock()-startTime)
+
+	#memory is measured in a separate pass, because tracing slows everything down.  tracemalloc can't count every allocation (memory
+	#that's allocated and freed again within the frame leaves no trace), so what's measured is the peak: the most memory the frame had in
+	#use at any one time beyond what was in use when it started - which is what its temporary lists, strings and tuples add up to.
+	peakBytes=0
+	memoryFrames=min(frames,1000)
+	tracemalloc.start()
+	for i in range(memoryFrames):
+		next(profile)
+		tracemalloc.reset_peak()
+		currentBefore=tracemalloc.get_traced_memory()[0]
+		frame()
+		peakBytes+=tracemalloc.get_traced_memory()[1]-currentBefore
+	tracemalloc.stop()
+
+	frameTimes.sort()
+	return {
+		'ns_per_frame': sum(frameTimes)/len(frameTimes)*1e9,
+		'p99_ns': frameTimes[int(len(frameTimes)*0.99)]*1e9,
+		'peak_bytes_per_frame': peakBytes/float(memoryFrames),
+	}
+
+def runStartupBenchmark(repeats=200):
+	#how long it takes to build both controllers, which is mostly ControlFactory and the compiled tables
+	clock=time.perf_counter
+	startTime=clock()
+	for i in range(repeats):
+		namedcontrollers.WarthogThrottle(SyntheticDevice())
+		namedcontrollers.WarthogStick(SyntheticDevice())
+	elapsed=clock()-startTime
+	
+	#and how much memory they hold on to, per control (including each control's share of its controller's event log)
+	tracemalloc.start()
+	memoryBefore=tracemalloc.get_traced_memory()[0]
+	throttle=namedcontrollers.WarthogThrottle(SyntheticDevice())
+	stick=namedcontrollers.WarthogStick(SyntheticDevice())
+	memoryUsed=tracemalloc.get_traced_memory()[0]-memoryBefore
+	tracemalloc.stop()
+	controls=len(throttle._allControls())+len(stick._allControls())
+	
+	return {'ns_per_startup': elapsed/repeats*1e9, 'bytes_per_control': memoryUsed/float(controls)}
+
+
+def main(arguments=None):
+	parser=argparse.ArgumentParser(description='Measure the per-frame cost of namedcontrollers.')
+	parser.add_argument('--frames',type=int,default=10000)
+	parser.add_argument('--profile',choices=sorted(profiles),action='append',help='input profile(s) to run (default: all)')
+	parser.add_argument('--workload',choices=sorted(workloads),action='append',help='workload(s) to run (default: all)')
+	parser.add_argument('--no-poll',action='store_true',help="don't call poll() - every control reads the device directly")
+	parser.add_argument('--baseline',default=os.path.join(os.path.dirname(os.path.abspath(__file__)),'benchmark_baseline.json'))
+	parser.add_argument('--save-baseline',action='store_true',help='store these results as the new baseline')
+	options=parser.parse_args(arguments)
+
+	baseline={}
+	if os.path.exists(options.baseline):
+		with open(options.baseline) as baselineFile:
+			baseline=json.load(baselineFile)
+
+	results={}
+	for profileName in options.profile or sorted(profiles):
+		for workloadName in options.workload or sorted(workloads):
+			key='%s/%s%s' % (profileName,workloadName,'/nopoll' if options.no_poll else '')
+			results[key]=runBenchmark(profileName,workloadName,options.frames,poll=not options.no_poll)
+	results['startup']=runStartupBenchmark()
+
+	for key in sorted(results):
+		line='%-24s' % key
+		for metric,value in sorted(results[key].items()):
+			line+='  %s=%.0f' % (metric,value)
+			if key in baseline and baseline[key].get(metric):
+				line+=' (%+.1f%%)' % ((value/baseline[key][metric]-1)*100)
+		print(line)
+
+	if options.save_baseline:
+		baseline.update(results)
+		with open(options.baseline,'w') as baselineFile:
+			json.dump(baseline,baselineFile,indent=1,sort_keys=True)
+		print('baseline saved to %s' % options.baseline)
+
+
+if __name__=='__main__':
+	main()
@@ -8,6 +8,10 @@ if starting:
 	throttle = namedcontrollers.WarthogThrottle(joystick[throttleID])
 	stick = namedcontrollers.WarthogStick(joystick[stickID])
 
+#read each device once per frame - all the named controls below use this snapshot
+throttle.poll()
+stick.poll()
+
 diagnostics.watch(throttle.toggles.apu() )
 diagnostics.watch(throttle.toggles.eac() )
 diagnostics.watch(throttle.toggles.eng_fuel_l() )
@@ -62,5 +66,9 @@ if len(throttle.buttons.eac.pressDurationsLog)>3 and throttle.buttons.eac.pressD
 	foo=True
 else:
 	foo=False
+
 diagnostics.watch(foo)
+
+#or, three presses of more than a second within the last ten seconds
+diagnostics.watch(len(throttle.buttons.eac.pressesLongerThan(1,10))>=3 )
 #TODO include all named buttons and toggles here for completeness
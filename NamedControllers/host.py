@@ -0,0 +1,271 @@
+#Headless host for namedcontrollers - runs controllers and a binding script under asyncio, outside FreePIE.
+#
+#Frames come from a pluggable async source: a Unix socket, a pipe, or a recording made with NamedController.startRecording().
+#Each frame is applied to a FrameDevice (which has the same getDown/getPressed/axes/sliders/pov surface as a FreePIE joystick),
+#the controllers are polled, and the script runs - so binding logic can be run, and soak tested, on Linux at any frame rate.
+#
+#	python host.py --script myscript.py --socket /tmp/namedcontrollers.sock
+#	feeder | python host.py --script myscript.py --pipe
+#	python host.py --script myscript.py --replay session.rec --device throttle --rate 250
+#
+#Socket and pipe frames are JSON, one per line, with the state of any devices that changed and optionally the time in seconds:
+#	{"time": 12.004, "throttle": {"buttons": [1, 22], "axes": {"z": 250}, "sliders": [0], "pov": [9000]}}
+#"buttons" is the friendly IDs of the buttons that are down, or an integer with bit (ID-1) set for each one.  A device that isn't
+#mentioned keeps its last state.
+#
+#The script is run once per frame, like a FreePIE script, with throttle, stick, starting, host and diagnostics in its globals.
+#
+#Needs Python 3.7 or later.
+
+import argparse
+import asyncio
+import json
+import sys
+
+import namedcontrollers
+
+
+class FrameDevice(object):
+	#Stands in for a FreePIE joystick, holding whatever state the last frame gave it
+
+	def __init__(self):
+		self.buttonBits=0
+		self.previousButtonBits=0
+		self.x=0
+		self.y=0
+		self.z=0
+		self.xRotation=0
+		self.yRotation=0
+		self.zRotation=0
+		self.sliders=[0,0]
+		self.pov=[-1,-1,-1,-1]
+
+	def getDown(self,id):
+		return self.buttonBits>>id & 1 == 1
+
+	def getPressed(self,id):
+		return (self.buttonBits & ~self.previousButtonBits)>>id & 1 == 1
+
+	def apply(self,state):
+		#take on the state in one device's part of a frame
+		self.previousButtonBits=self.buttonBits
+		buttons=state.get('buttons')
+		if isinstance(buttons,int):
+			self.buttonBits=buttons
+		elif buttons is not None:
+			self.buttonBits=0
+			for friendlyButtonID in buttons:
+				self.buttonBits|=1<<(friendlyButtonID-1)
+		for axis,value in state.get('axes',{}).items():
+			setattr(self,axis,value)
+		for index,value in enumerate(state.get('sliders',())):
+			self._set(self.sliders,index,value,0)
+		for index,value in enumerate(state.get('pov',())):
+			self._set(self.pov,index,value,-1)
+
+	def _set(self,values,index,value,default):
+		if index>=len(values):
+			values.extend([default]*(index+1-len(values)))
+		values[index]=value
+
+
+#Frame sources - each is an async iterator of frames (dicts like the JSON above)
+
+async def streamSource(reader):
+	#frames from an asyncio StreamReader, one JSON object per line
+	while True:
+		line=await reader.readline()
+		if not line:
+			return
+		line=line.strip()
+		if line:
+			yield json.loads(line.decode('utf-8'))
+
+async def pipeSource(pipe=None):
+	#frames from a pipe - stdin, by default
+	loop=asyncio.get_running_loop()
+	reader=asyncio.StreamReader()
+	await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),pipe or sys.stdin)
+	async for frame in streamSource(reader):
+		yield frame
+
+async def unixSocketSource(path,maxsize=64):
+	#frames from any number of clients connecting to a Unix socket at <path>, in the order they arrive.
+	#When the host falls behind, the clients' connections stop being read, so they're held back by the socket rather than piling up here.
+	frames=asyncio.Queue(maxsize)
+
+	async def client(reader,writer):
+		try:
+			async for frame in streamSource(reader):
+				await frames.put(frame)
+		finally:
+			writer.close()
+
+	server=await asyncio.start_unix_server(client,path)
+	try:
+		while True:
+			yield await frames.get()
+	finally:
+		server.close()
+
+async def replaySource(path,device='throttle'):
+	#frames from a recording made with NamedController.startRecording(), for <device>, with their original times
+	replay=namedcontrollers.ReplayController(path)
+	try:
+		while replay.advance():
+			state={
+				'buttons': replay.buttonBits,
+				'axes': dict( (source,getattr(replay,source)) for source in replay.axisSources if not isinstance(source,int) ),
+				'sliders': list(replay.sliders),
+				'pov': list(replay.pov),
+			}
+			yield {'time': replay.time, device: state}
+			#let everything else run between frames, as a socket or pipe would
+			await asyncio.sleep(0)
+	finally:
+		replay.close()
+
+
+class Diagnostics(object):
+	#a stand-in for FreePIE's diagnostics, for scripts run by the host
+
+	def __init__(self,verbose=False):
+		self.verbose=verbose
+		self.watches=[]
+
+	def watch(self,value):
+		self.watches.append(value)
+
+	def debug(self,message):
+		print(message)
+
+	def endFrame(self):
+		if self.verbose and self.watches:
+			print(' | '.join( str(value) for value in self.watches ))
+		self.watches=[]
+
+
+class Host(object):
+	#Runs controllers from a frame source.  Reading frames and running the controllers are separate tasks, joined by a bounded queue:
+	#when frames arrive faster than the polls and rules can handle them, the reader waits for room, which holds back the source
+	#(a socket or pipe stops being read), rather than frames being dropped or piling up without limit.
+
+	controllerClasses={'throttle': namedcontrollers.WarthogThrottle, 'stick': namedcontrollers.WarthogStick}
+
+	def __init__(self,controllerClasses=None,historyLength=20,queueSize=8,rate=None):
+		#with frames that carry their own time, the controllers run on that time - otherwise on the time each frame is processed
+		self.clock=namedcontrollers.VirtualClock()
+		self.devices={}
+		self.controllers={}
+		for name,controllerClass in (controllerClasses or self.controllerClasses).items():
+			self.devices[name]=FrameDevice()
+			self.controllers[name]=controllerClass(self.devices[name],historyLength=historyLength,clock=self.clock)
+		self.queueSize=queueSize
+		self.rate=rate	#frames per second to pace the frames at, or None for as fast as they come
+		self.frames=0
+		self.framesWaited=0	#how many times the reader had to wait for the controllers to catch up
+
+	def applyFrame(self,frame):
+		if 'time' in frame:
+			self.clock.set(frame['time'])
+		else:
+			self.clock.set(namedcontrollers.monotonic())
+		for name,device in self.devices.items():
+			if name in frame:
+				device.apply(frame[name])
+			else:
+				device.previousButtonBits=device.buttonBits
+		for controller in self.controllers.values():
+			controller.poll()
+		self.frames+=1
+
+	async def run(self,source,script=None):
+		#script(host) is called (and awaited, if it's a coroutine function) after every frame.  Returns when the source runs out.
+		queue=asyncio.Queue(self.queueSize)
+
+		async def read():
+			try:
+				async for frame in source:
+					if queue.full():
+						self.framesWaited+=1
+					await queue.put(frame)
+			finally:
+				await queue.put(None)
+
+		async def process():
+			loop=asyncio.get_running_loop()
+			nextFrameTime=loop.time()
+			while True:
+				frame=await queue.get()
+				if frame is None:
+					return
+				self.applyFrame(frame)
+				if script is not None:
+					result=script(self)
+					if asyncio.iscoroutine(result):
+						await result
+				if self.rate:
+					nextFrameTime+=1.0/self.rate
+					await asyncio.sleep(max(0.0,nextFrameTime-loop.time()))
+				else:
+					#give the reader (and anything else) a turn between frames
+					await asyncio.sleep(0)
+
+		reader=asyncio.ensure_future(read())
+		try:
+			await process()
+		finally:
+			reader.cancel()
+			try:
+				await reader
+			except asyncio.CancelledError:
+				pass
+
+
+def scriptRunner(path,diagnostics):
+	#runs a FreePIE-style script once per frame, with the host's controllers as globals
+	with open(path) as scriptFile:
+		code=compile(scriptFile.read(),path,'exec')
+	scriptGlobals={'diagnostics': diagnostics, 'namedcontrollers': namedcontrollers}
+
+	def run(host):
+		scriptGlobals.update(host.controllers)
+		scriptGlobals['host']=host
+		scriptGlobals['starting']=host.frames==1
+		exec(code,scriptGlobals)
+		diagnostics.endFrame()
+	return run
+
+
+def main(arguments=None):
+	parser=argparse.ArgumentParser(description='Run namedcontrollers and a binding script headless, from a stream of frames.')
+	sources=parser.add_mutually_exclusive_group(required=True)
+	sources.add_argument('--socket',help='listen for frames on this Unix socket')
+	sources.add_argument('--pipe',action='store_true',help='read frames from stdin')
+	sources.add_argument('--replay',help='replay this recording')
+	parser.add_argument('--device',default='throttle',choices=sorted(Host.controllerClasses),help='the device the recording is of (with --replay)')
+	parser.add_argument('--script',help='the script to run each frame')
+	parser.add_argument('--rate',type=float,help='frames per second (default: as fast as frames arrive)')
+	parser.add_argument('--history-length',type=int,default=20)
+	parser.add_argument('--queue-size',type=int,default=8,help='how many frames can be waiting before the source is held back')
+	parser.add_argument('--verbose',action='store_true',help="print the script's watched values every frame")
+	options=parser.parse_args(arguments)
+
+	host=Host(historyLength=options.history_length,queueSize=options.queue_size,rate=options.rate)
+	script=scriptRunner(options.script,Diagnostics(options.verbose)) if options.script else None
+	if options.socket:
+		source=unixSocketSource(options.socket)
+	elif options.pipe:
+		source=pipeSource()
+	else:
+		source=replaySource(options.replay,options.device)
+
+	try:
+		asyncio.run(host.run(source,script))
+	except KeyboardInterrupt:
+		pass
+	print('%d frames, held the source back %d times' % (host.frames,host.framesWaited))
+
+
+if __name__=='__main__':
+	main()
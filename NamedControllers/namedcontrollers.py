@@ -1,40 +1,2292 @@
+import bisect
 import functools
 import sys
 import collections
 import time
+import json
+import struct
+import threading
+import copy
+import errno
+import heapq
+import hashlib
+import os
+import stat
+import marshal
+import socket
+from array import array
 
-clockstart=time.clock()
+#The best monotonic, high resolution timer available - time.clock() on IronPython/Python 2, time.perf_counter() on Python 3
+monotonic=getattr(time,'perf_counter',None) or time.clock
 
-class MockController(object):
-	def getDown(self, id):
-		return 'fish %s' % id
+
+class VirtualClock(object):
+	#A clock that only moves when it's told to, for tests, benchmarks and replays:
+	#	clock=namedcontrollers.VirtualClock()
+	#	throttle=namedcontrollers.WarthogThrottle(device, clock=clock)
+	#	clock.advance(1/250.0)
+	#	throttle.poll()
+	#Any function that returns the time in seconds can be used as a NamedController's clock.
+	
+	def __init__(self,start=0.0):
+		self.time=start
+		
+	def __call__(self):
+		return self.time
+		
+	def advance(self,seconds):
+		self.time+=seconds
+		return self.time
+		
+	def set(self,time):
+		self.time=time
+
+#Recordings of controller input are a short header followed by one delta-encoded record per frame:
+#
+#	magic 'NCR1', a 4-byte little-endian header length, then the header as JSON - the axis sources and POV indexes that were recorded, and the start time.
+#	Then for each frame:
+#		a flags byte - which of the buttons (1), axes (2) and POVs (4) changed since the previous frame
+#		a varint - the microseconds since the previous frame
+#		if the buttons changed, a varint - the XOR of the old and new button bits
+#		if the axes changed, a varint - a mask of the axes that changed, and a zigzag varint for each of their new values
+#		if the POVs changed, the same again for the POVs
+#
+#An idle frame therefore costs two bytes.
+RECORDING_MAGIC=b'NCR1'
+RECORDING_BUTTONS=1
+RECORDING_AXES=2
+RECORDING_POVS=4
+
+
+def _appendVarint(buffer,value):
+	while value>0x7f:
+		buffer.append((value & 0x7f) | 0x80)
+		value>>=7
+	buffer.append(value)
+	
+def _zigzag(value):
+	return value*2 if value>=0 else -value*2-1
+	
+def _unzigzag(value):
+	return value//2 if value%2==0 else -(value+1)//2
+
+
+class Instrumentation(object):
+	#Counts calls to, and accumulates the time spent in, each control's accessors, and checks each frame's total against a budget.
+	#See NamedController.enableInstrumentation().
+	
+	#the methods that get timed, on whichever control classes have them
+	accessors=('getValue','getRawValue','checkMorseLog','getDown','down','activatedNow','getPressed','activatedOnce','pressedFor','heldFor',
+		'getTimeSinceLastStateChange','getTimeSinceLastPress','getTimeSinceLastRelease','getLog','getHistory','printMorseLog',
+		'changedThisFrame','getPreviousValue','changedTo','changedFrom','countPresses','countReleases','pressesLongerThan','stateAt','countChanges','getValueAt')
+	
+	instrumentedClasses={}	#control class -> instrumented subclass, shared by every controller
+	
+	def __init__(self,budget=0.004,worstOffenders=5):
+		self.budget=budget
+		self.worstOffenders=worstOffenders
+		self.clock=monotonic	#always real time, whatever clock the controller uses
+		
+		self.calls={}	#(control name, accessor) -> number of calls
+		self.totals={}	#(control name, accessor) -> total seconds
+		self.frameTotals={}	#(control name, accessor) -> seconds, for the current frame only
+		self.frameTime=0.0
+		self.depth=0	#so that accessors which call other accessors don't count twice towards the frame's total
+		self.frames=0
+		self.framesOverBudget=0
+		self.worstFrameTime=0.0
+		self.lastOverBudget=()	#the worst offenders of the most recent frame to go over budget
+		
+	def instrument(self,control):
+		originalClass=control.__class__
+		if originalClass in self.instrumentedClasses.values():
+			return
+		if originalClass not in self.instrumentedClasses:
+			#no __slots__ of its own, so that a control's class can be swapped to it and back
+			namespace={'__slots__':()}
+			for accessor in self.accessors:
+				if hasattr(originalClass,accessor):
+					namespace[accessor]=_timedAccessor(accessor,getattr(originalClass,accessor))
+			self.instrumentedClasses[originalClass]=type(originalClass.__name__,(originalClass,),namespace)
+		control.__class__=self.instrumentedClasses[originalClass]
+		
+	def uninstrument(self,control):
+		if control.__class__ in self.instrumentedClasses.values():
+			control.__class__=control.__class__.__bases__[0]
+			
+	def instrumentPoll(self,controller):
+		originalPoll=controller.poll
+		def poll():
+			self.endFrame()
+			startTime=self.clock()
+			originalPoll()
+			self.record(controller.__class__.__name__,'poll',self.clock()-startTime)
+		return poll
+		
+	def record(self,controlName,accessor,elapsed):
+		key=(controlName,accessor)
+		self.calls[key]=self.calls.get(key,0)+1
+		self.totals[key]=self.totals.get(key,0.0)+elapsed
+		self.frameTotals[key]=self.frameTotals.get(key,0.0)+elapsed
+		if self.depth==0:
+			self.frameTime+=elapsed
+			
+	def endFrame(self):
+		if self.frames:
+			self.worstFrameTime=max(self.worstFrameTime,self.frameTime)
+			if self.frameTime>self.budget:
+				self.framesOverBudget+=1
+				self.lastOverBudget=self._worst(self.frameTotals)
+		self.frames+=1
+		self.frameTime=0.0
+		self.frameTotals.clear()
+		
+	def _worst(self,totals):
+		return tuple(sorted(totals.items(), key=lambda item: item[1], reverse=True)[:self.worstOffenders])
+		
+	def summary(self):
+		#a one-line summary, suitable for diagnostics.watch()
+		result='frames=%d over budget=%d worst=%.2fms' % (self.frames,self.framesOverBudget,self.worstFrameTime*1000)
+		if self.lastOverBudget:
+			result+=' | last over budget: '+', '.join( '%s.%s %.3fms' % (controlName,accessor,elapsed*1000) for (controlName,accessor),elapsed in self.lastOverBudget )
+		result+=' | overall: '+', '.join( '%s.%s %.3fms/%d' % (controlName,accessor,elapsed*1000,self.calls[(controlName,accessor)]) for (controlName,accessor),elapsed in self._worst(self.totals) )
+		return result
+		
+		
+class DiagnosticsPublisher(object):
+	#Publishes watched values only when they've changed, and no more than <rate> times a second.  See NamedController.startDiagnostics().
+	#Nothing is read between publishes, and logs (EventLogViews, or a control's accessors that only read its log) are only formatted when
+	#something has been added to them, so watching costs next to nothing while nothing is happening.
+	
+	#the control accessors whose values only change when the control's event log does
+	logAccessors=('getLog','getHistory','printMorseLog','getPressesLog','getReleasesLog',
+		'getDurationOfMostRecentPressedState','getDurationOfMostRecentReleasedState')
+	
+	def __init__(self,output,rate=10):
+		self.output=output
+		self.setRate(rate)
+		self.nextPublishTime=0.0
+		self.watches=[]
+		self.publishes=0
+		
+	def setRate(self,rate):
+		#<rate> publishes a second at most, or every frame for 0 or None
+		self.interval=1.0/rate if rate else 0.0
+		
+	def watch(self,name,source,format=str,version=None):
+		#Publish <source> (a control, a control's log, or any function) as <name>.  Its value is format(value).
+		#If version() is given, <source> is only read again when version() returns something new.
+		if isinstance(source,EventLogView):
+			log=source
+			source=lambda: log
+			if version is None:
+				version=self._logVersion(log.eventLog,log.slot)
+			if format is str:
+				format=_formatMorse if log.field=='morse' else _formatLog
+		elif version is None and getattr(source,'__name__',None) in self.logAccessors and isinstance(getattr(source,'__self__',None),NamedControl):
+			control=source.__self__
+			version=self._logVersion(control.parent.eventLog,control.logSlot)
+		self.unwatch(name)
+		self.watches.append(_Watch(name,source,format,version))
+		
+	def _logVersion(self,eventLog,slot):
+		counts=eventLog.counts
+		return lambda: counts[slot]
+		
+	def unwatch(self,name):
+		self.watches=[ watch for watch in self.watches if watch.name!=name ]
+		
+	def publish(self,timeNow=0.0):
+		#output everything that has changed since it was last output
+		self.nextPublishTime=timeNow+self.interval
+		self.publishes+=1
+		output=self.output
+		for watch in self.watches:
+			if watch.version is not None:
+				version=watch.version()
+				if version==watch.lastVersion:
+					continue
+				watch.lastVersion=version
+				value=watch.source()
+			else:
+				value=watch.source()
+				if watch.published and value==watch.lastValue:
+					continue
+				watch.lastValue=value
+			text=watch.format(value)
+			if watch.published and text==watch.lastText:
+				continue
+			watch.lastText=text
+			watch.published=True
+			output(watch.name,text)
+			
+	def resend(self):
+		#output every value at the next publish, changed or not
+		for watch in self.watches:
+			watch.published=False
+			watch.lastVersion=None
+			
+			
+class _Watch(object):
+	__slots__=('name','source','format','version','lastVersion','lastValue','lastText','published')
+	
+	def __init__(self,name,source,format,version):
+		self.name=name
+		self.source=source
+		self.format=format
+		self.version=version
+		self.lastVersion=None
+		self.lastValue=None
+		self.lastText=None
+		self.published=False
+		
+		
+def _formatLog(log):
+	return repr(list(log))
+	
+def _formatMorse(log):
+	return ''.join(log)
+	
+	
+def _timedAccessor(accessor,method):
+	def timed(self,*args,**kwargs):
+		instrumentation=self.parent.instrumentation
+		instrumentation.depth+=1
+		startTime=instrumentation.clock()
+		try:
+			return method(self,*args,**kwargs)
+		finally:
+			elapsed=instrumentation.clock()-startTime
+			instrumentation.depth-=1
+			instrumentation.record(self.name,accessor,elapsed)
+	timed.__name__=accessor
+	return timed
+
+
+class InputSampler(object):
+	#Polls a controller's buttons from a background thread, faster than the script runs, and queues every edge it sees with its timestamp.
+	#The queue is double-buffered: the sampler appends to one list while the script thread processes the other, and they are swapped once per frame.
+	#Use NamedController.startSampler() rather than making one of these directly.
+	
+	def __init__(self,parent,rate=1000):
+		self.parent=parent
+		self.interval=1.0/rate
+		self.buttonBits=parent.buttonBits
+		self.lock=threading.Lock()
+		self.pending=[]	#(zeroIndexedButtonID, downNow, timeNow) edges, being written by the sampler
+		self.spare=[]
+		self.running=False
+		self.thread=None
+		
+	def start(self):
+		self.running=True
+		self.thread=threading.Thread(target=self.run,name='NamedController sampler')
+		self.thread.daemon=True
+		self.thread.start()
+		
+	def stop(self):
+		self.running=False
+		if self.thread is not None:
+			self.thread.join()
+			self.thread=None
+		
+	def run(self):
+		getDown=self.parent.controller.getDown
+		pollButtons=self.parent.pollButtons
+		clock=self.parent.clock
+		while self.running:
+			timeNow=clock()
+			buttonBits=0
+			for zeroIndexedButtonID,bit in pollButtons:
+				if getDown(zeroIndexedButtonID):
+					buttonBits|=bit
+			changedBits=buttonBits ^ self.buttonBits
+			if changedBits:
+				with self.lock:
+					while changedBits:
+						bit=changedBits & -changedBits
+						changedBits^=bit
+						self.pending.append( (bit.bit_length()-1, buttonBits & bit != 0, timeNow) )
+				self.buttonBits=buttonBits
+			time.sleep(self.interval)
+			
+	def drain(self):
+		#take everything queued since the last frame, and give the sampler the other buffer to write into
+		with self.lock:
+			edges=self.pending
+			self.pending=self.spare
+		return edges
 		
-	def getPressed(self, id):
-		return 'finger %s' % id
+	def recycle(self,edges):
+		del edges[:]
+		self.spare=edges
+		
+
+class InputRecorder(object):
+	#Appends every frame of a NamedController's snapshot to a recording file (see above).  Use NamedController.startRecording() rather than making one of these directly.
 	
+	def __init__(self,parent,path):
+		self.parent=parent
+		self.file=open(path,'wb')
+		header=json.dumps({
+			'axes': [ source for slot,source in parent.pollAxes ],
+			'povs': list(parent.pollPOVs),
+			'startTime': parent.timeNow,
+		}).encode('utf-8')
+		self.file.write(RECORDING_MAGIC+struct.pack('<I',len(header))+header)
+		
+		self.buffer=bytearray()
+		self.buttonBits=0
+		self.axisValues=[0]*len(parent.axisValues)
+		self.povValues=[ -1 for index in parent.pollPOVs ]
+		self.previousTime=parent.timeNow
+		
+	def write(self):
+		parent=self.parent
+		buffer=self.buffer
+		del buffer[:]
+		buffer.append(0)
+		flags=0
+		
+		_appendVarint(buffer,max(0,int(round((parent.timeNow-self.previousTime)*1000000))))
+		self.previousTime=parent.timeNow
+		
+		changedBits=parent.buttonBits ^ self.buttonBits
+		if changedBits:
+			flags|=RECORDING_BUTTONS
+			_appendVarint(buffer,changedBits)
+			self.buttonBits=parent.buttonBits
+			
+		if self._writeChanges(buffer,parent.axisValues,self.axisValues):
+			flags|=RECORDING_AXES
+		if self._writeChanges(buffer,[ parent.povValues[index] for index in parent.pollPOVs ],self.povValues):
+			flags|=RECORDING_POVS
+		
+		buffer[0]=flags
+		self.file.write(buffer)
+		
+	@staticmethod
+	def _writeChanges(buffer,values,previousValues):
+		changedMask=0
+		for index in range(len(values)):
+			if int(round(values[index]))!=previousValues[index]:
+				changedMask|=1<<index
+		if not changedMask:
+			return False
+		_appendVarint(buffer,changedMask)
+		for index in range(len(values)):
+			if changedMask>>index & 1:
+				previousValues[index]=int(round(values[index]))
+				_appendVarint(buffer,_zigzag(previousValues[index]))
+		return True
+		
+	def close(self):
+		self.file.close()
+		
+		
+class ReplayController(object):
+	#Plays back a recording made by NamedController.startRecording(), standing in for the FreePIE device:
+	#	replay=namedcontrollers.ReplayController('session.rec')
+	#	throttle=namedcontrollers.WarthogThrottle(replay, clock=replay.clock)
+	#	while replay.advance():
+	#		throttle.poll()
+	#		...
+	#The recording is read through a memory map, so even very long sessions can be replayed as fast as the CPU allows.
+	
+	def __init__(self,path):
+		import mmap
+		self.file=open(path,'rb')
+		self.data=mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+		if self.data[0:4]!=RECORDING_MAGIC:
+			raise ValueError('%s is not a controller recording' % path)
+		headerLength=struct.unpack_from('<I',self.data,4)[0]
+		self.header=json.loads(self.data[8:8+headerLength].decode('utf-8'))
+		self.framesStart=8+headerLength
+		
+		if sys.version_info[0]>=3:
+			self._byte=self.data.__getitem__
+		else:
+			self._byte=lambda position: ord(self.data[position])
+		
+		self.axisSources=self.header['axes']
+		self.povIndexes=self.header['povs']
+		self.rewind()
+		
+	def rewind(self):
+		self.position=self.framesStart
+		self.frame=0
+		self.time=self.header['startTime']
+		self.buttonBits=0
+		self.previousButtonBits=0
+		self.axisValues=[0]*len(self.axisSources)
+		
+		sliders=[ source for source in self.axisSources if isinstance(source,int) ]
+		self.sliders=[0]*(max(sliders)+1 if sliders else 0)
+		self.pov=[-1]*(max(self.povIndexes)+1 if self.povIndexes else 0)
+		for source in self.axisSources:
+			if not isinstance(source,int):
+				setattr(self,source,0)
+		
+	def _readVarint(self):
+		value=0
+		shift=0
+		while True:
+			byte=self._byte(self.position)
+			self.position+=1
+			value|=(byte & 0x7f)<<shift
+			if byte<0x80:
+				return value
+			shift+=7
+			
+	def advance(self):
+		#read the next frame - returns False at the end of the recording
+		if self.position>=len(self.data):
+			return False
+		flags=self._byte(self.position)
+		self.position+=1
+		self.time+=self._readVarint()/1000000.0
+		
+		self.previousButtonBits=self.buttonBits
+		if flags & RECORDING_BUTTONS:
+			self.buttonBits^=self._readVarint()
+		if flags & RECORDING_AXES:
+			changedMask=self._readVarint()
+			for slot,source in enumerate(self.axisSources):
+				if changedMask>>slot & 1:
+					value=_unzigzag(self._readVarint())
+					self.axisValues[slot]=value
+					if isinstance(source,int):
+						self.sliders[source]=value
+					else:
+						setattr(self,source,value)
+		if flags & RECORDING_POVS:
+			changedMask=self._readVarint()
+			for position,index in enumerate(self.povIndexes):
+				if changedMask>>position & 1:
+					self.pov[index]=_unzigzag(self._readVarint())
+		
+		self.frame+=1
+		return True
+		
+	def getDown(self,id):
+		return self.buttonBits>>id & 1 == 1
+		
+	def getPressed(self,id):
+		return (self.buttonBits & ~self.previousButtonBits)>>id & 1 == 1
+		
+	def clock(self):
+		#the time the current frame was recorded - pass this as the controller's clock to replay the original timings exactly
+		return self.time
+		
+	def close(self):
+		self.data.close()
+		self.file.close()
+	
+		
+#Published state is sent as datagrams, each starting with STATE_MAGIC, a kind byte, and varints of its sequence number and the schema ID
+#(a hash of the schema).  A schema datagram is then the schema as JSON: the names of every button, and of every toggle, hat and axis,
+#in the order of their interned IDs.  A delta or keyframe datagram is then a byte of STATE_ flags, followed by whichever of these it has:
+#	STATE_BUTTONS:	a varint of all of the button bits
+#	STATE_STATES:	a varint count, then that many (toggle or hat ID, state index) varint pairs
+#	STATE_AXES:		a varint count, then that many (axis ID, zigzag varint value) pairs - shaped axes' values are scaled by STATE_AXIS_SCALE
+#Every value sent is absolute, so a lost datagram only delays a change (until the next one, or the next keyframe) rather than corrupting the state.
+#The schema is only sent every so often (it's a few kilobytes), always followed by a keyframe; the schema ID in every datagram tells a
+#subscriber whether it has the right one.
+STATE_MAGIC=b'NS'
+STATE_DELTA=0
+STATE_KEYFRAME=1
+STATE_SCHEMA=2
+STATE_BUTTONS=1
+STATE_STATES=2
+STATE_AXES=4
+STATE_AXIS_SCALE=10000
+
+def _readVarint(data,position):
+	#returns (value, position after it)
+	value=0
+	shift=0
+	while True:
+		byte=data[position]
+		position+=1
+		value|=(byte & 0x7f)<<shift
+		if byte<0x80:
+			return value,position
+		shift+=7
+		
+def _datagramSocket(address):
+	#a (host, port) pair is UDP, and a path is a Unix datagram socket
+	if isinstance(address,tuple):
+		return socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+	return socket.socket(socket.AF_UNIX,socket.SOCK_DGRAM)
+	
+	
+class StatePublisher(object):
+	#Sends a NamedController's state as datagrams (see above), at the end of each poll().  Use NamedController.startPublishing().
+	
+	def __init__(self,parent,address,keyframeInterval=250,axisThreshold=0.001,schemaInterval=1000):
+		self.parent=parent
+		self.address=address
+		self.socket=_datagramSocket(address)
+		#a subscriber that has stopped reading must never hold up poll() - its datagrams are dropped instead
+		self.socket.setblocking(False)
+		self.keyframeInterval=keyframeInterval
+		self.schemaInterval=schemaInterval
+		self.sequence=0
+		self.nextKeyframe=0
+		self.nextSchema=0
+		
+		#intern every control to an ID: buttons are already their bits, toggles and hats are numbered in name order, and so are the
+		#distinct axes (every name for the same input shares an ID)
+		profile=parent.profile
+		self.stateControls=sorted( list(parent.toggles.controlsByKey.values())+list(parent.hats.controlsByKey.values()), key=lambda control: control.names[0] )
+		self.axisControls=[ getattr(parent.axes,sorted(names)[0]) for key,names in sorted(profile.namesByKey['axes'].items(), key=lambda item: sorted(item[1])[0]) ]
+		
+		#axis values are sent as integers - raw values as they are, and shaped values scaled up - once they've moved by more than the threshold
+		low,high=parent.axisRange
+		self.rawAxes=[]
+		self.shapedAxes=[]
+		for id,control in enumerate(self.axisControls):
+			if control.pipeline is None:
+				self.rawAxes.append( (id,control.slot,max(1,int(axisThreshold*(high-low)))) )
+			else:
+				self.shapedAxes.append( (id,control.pipeline.shapedSlot,max(1,int(axisThreshold*2*STATE_AXIS_SCALE))) )
+		
+		#each toggle's and hat's state names (by their state index) in every naming strategy, with '' for the default one
+		schema={
+			'name': parent.__class__.__name__,
+			'buttons': profile.definitions['buttons'],
+			'states': [ {'type': control.controlType, 'names': list(control.names), 'stateNames': self._stateNames(control)} for control in self.stateControls ],
+			'axes': [ {'names': list(control.names), 'shaped': control.pipeline is not None} for control in self.axisControls ],
+		}
+		self.schema=json.dumps(schema,sort_keys=True).encode('utf-8')
+		self.schemaID=int(hashlib.sha1(self.schema).hexdigest()[:8],16)
+		
+		#what each subscriber has been sent
+		self.buttonBits=None
+		self.stateIndexes=[None]*len(self.stateControls)
+		self.axisValues=[0]*len(self.axisControls)
+		
+		self.buffer=bytearray()
+		self.datagramsSent=0
+		self.bytesSent=0
+		
+	def _stateNames(self,control):
+		if not isinstance(control,NamedButtonGroup):
+			return {'': [ control.stateName(state) for state in control.states ]}
+		return dict( (namingStrategy,[ control.stateName(state,namingStrategy) for state in control.states ]) for namingStrategy in ['']+list(self.parent.namingStrategies) )
+		
+	def _start(self,kind):
+		buffer=self.buffer
+		del buffer[:]
+		buffer.extend(STATE_MAGIC)
+		buffer.append(kind)
+		_appendVarint(buffer,self.sequence)
+		_appendVarint(buffer,self.schemaID)
+		self.sequence+=1
+		return buffer
+		
+	def _send(self,buffer):
+		try:
+			self.socket.sendto(buffer,self.address)
+		except (socket.error,OSError) as error:
+			#nobody listening (yet), or they're not keeping up - the state is published regardless
+			if getattr(error,'errno',None) in (errno.ENOENT,errno.ECONNREFUSED):
+				#nobody is bound to the address (only Unix sockets can tell), so whoever binds it next gets the schema on the very next frame
+				self.nextSchema=self.parent.frame+1
+		self.datagramsSent+=1
+		self.bytesSent+=len(buffer)
+		
+	def write(self):
+		parent=self.parent
+		frame=parent.frame
+		if frame>=self.nextSchema:
+			#so that a subscriber that has just got the schema has everything straight away, a keyframe always follows it
+			self.nextSchema=frame+self.schemaInterval
+			self.nextKeyframe=frame
+			buffer=self._start(STATE_SCHEMA)
+			buffer.extend(self.schema)
+			self._send(buffer)
+		keyframe=frame>=self.nextKeyframe
+		if keyframe:
+			self.nextKeyframe=frame+self.keyframeInterval
+		
+		buttonsChanged=keyframe or parent.buttonBits!=self.buttonBits
+		
+		#toggles and hats: poll() has already marked the ones that changed this frame
+		stateChanges=[]
+		sent=self.stateIndexes
+		for id,control in enumerate(self.stateControls):
+			if keyframe or control.changedFrame==frame:
+				index=control.stateIndexes.get(control.state,0)
+				if keyframe or index!=sent[id]:
+					stateChanges.append( (id,index) )
+					sent[id]=index
+		
+		axisChanges=[]
+		sent=self.axisValues
+		axisValues=parent.axisValues
+		for id,slot,threshold in self.rawAxes:
+			value=axisValues[slot]
+			if keyframe or abs(value-sent[id])>=threshold:
+				axisChanges.append( (id,value) )
+				sent[id]=value
+		shapedAxisValues=parent.shapedAxisValues
+		for id,slot,threshold in self.shapedAxes:
+			value=int(round(shapedAxisValues[slot]*STATE_AXIS_SCALE))
+			if keyframe or abs(value-sent[id])>=threshold:
+				axisChanges.append( (id,value) )
+				sent[id]=value
+		
+		if not (buttonsChanged or stateChanges or axisChanges):
+			#nothing changed, so there's nothing to send
+			return
+		
+		buffer=self._start(STATE_KEYFRAME if keyframe else STATE_DELTA)
+		buffer.append( (STATE_BUTTONS if buttonsChanged else 0) | (STATE_STATES if stateChanges else 0) | (STATE_AXES if axisChanges else 0) )
+		if buttonsChanged:
+			_appendVarint(buffer,parent.buttonBits)
+			self.buttonBits=parent.buttonBits
+		if stateChanges:
+			_appendVarint(buffer,len(stateChanges))
+			for id,index in stateChanges:
+				_appendVarint(buffer,id)
+				_appendVarint(buffer,index)
+		if axisChanges:
+			_appendVarint(buffer,len(axisChanges))
+			for id,value in axisChanges:
+				_appendVarint(buffer,id)
+				_appendVarint(buffer,_zigzag(value))
+		self._send(buffer)
+		
+	def close(self):
+		self.socket.close()
+		
+		
+class StateSubscriber(object):
+	#Receives the datagrams from a StatePublisher, and keeps a read-only named view of the publishing controller up to date:
+	#	subscriber=namedcontrollers.StateSubscriber(('127.0.0.1',9450))
+	#	...
+	#	subscriber.receive()
+	#	if subscriber.view is not None:
+	#		print(subscriber.view.toggles.flaps(), subscriber.view.axes.left())
+	#view is None until the first schema arrives (every <schemaInterval> frames, when publishing starts, and on a Unix socket, as soon as it's bound).  receive() never blocks, so call it whenever you're ready for
+	#the latest state - or wait on fileno() first, with select or an event loop.
+	
+	def __init__(self,address):
+		self.address=address
+		self.socket=_datagramSocket(address)
+		self.boundFile=None
+		if not isinstance(address,tuple):
+			try:
+				existing=os.stat(address)
+			except OSError:
+				existing=None
+			if existing is not None:
+				if not stat.S_ISSOCK(existing.st_mode):
+					self.socket.close()
+					raise ValueError('%r already exists and isn\'t a socket' % (address,))
+				#a socket file left behind by an earlier subscriber
+				os.remove(address)
+		self.socket.bind(address)
+		if not isinstance(address,tuple):
+			#remember which file we bound, so that close() never removes one that has since been replaced
+			bound=os.stat(address)
+			self.boundFile=(bound.st_dev,bound.st_ino)
+		self.socket.setblocking(False)
+		
+		self.schemaID=None
+		self.view=None
+		self.sequence=-1
+		self.buttonBits=0
+		self.stateIndexes=[]
+		self.axisValues=[]
+		self.datagramsReceived=0
+		self.datagramsLost=0	#deltas that went missing or arrived too late, judging by the sequence numbers
+		
+	def fileno(self):
+		return self.socket.fileno()
+		
+	def receive(self):
+		#apply every datagram that has arrived, and return how many there were
+		count=0
+		while True:
+			try:
+				data=self.socket.recv(65536)
+			except (socket.error,OSError):
+				#nothing more waiting
+				return count
+			count+=1
+			self.apply(bytearray(data))
+			
+	def apply(self,data):
+		if data[0:2]!=STATE_MAGIC:
+			return
+		kind=data[2]
+		sequence,position=_readVarint(data,3)
+		schemaID,position=_readVarint(data,position)
+		self.datagramsReceived+=1
+		
+		if kind==STATE_SCHEMA:
+			if schemaID!=self.schemaID:
+				self._loadSchema(json.loads(bytes(data[position:]).decode('utf-8')),schemaID)
+			self.sequence=sequence
+			return
+		if schemaID!=self.schemaID:
+			#a frame from a publisher whose schema we haven't seen yet - wait for its next keyframe
+			return
+		if kind==STATE_DELTA:
+			if sequence<=self.sequence:
+				#older than something we've already applied
+				self.datagramsLost+=1
+				return
+			self.datagramsLost+=sequence-self.sequence-1
+		self.sequence=sequence
+		
+		flags=data[position]
+		position+=1
+		if flags & STATE_BUTTONS:
+			self.buttonBits,position=_readVarint(data,position)
+		if flags & STATE_STATES:
+			count,position=_readVarint(data,position)
+			for i in range(count):
+				id,position=_readVarint(data,position)
+				self.stateIndexes[id],position=_readVarint(data,position)
+		if flags & STATE_AXES:
+			count,position=_readVarint(data,position)
+			for i in range(count):
+				id,position=_readVarint(data,position)
+				value,position=_readVarint(data,position)
+				self.axisValues[id]=_unzigzag(value)
+				
+	def _loadSchema(self,schema,schemaID):
+		self.schemaID=schemaID
+		self.stateIndexes=[0]*len(schema['states'])
+		self.axisValues=[0]*len(schema['axes'])
+		self.view=StateView(self,schema)
+		
+	def close(self):
+		self.socket.close()
+		if self.boundFile is not None:
+			try:
+				current=os.stat(self.address)
+			except OSError:
+				current=None
+			if current is not None and stat.S_ISSOCK(current.st_mode) and (current.st_dev,current.st_ino)==self.boundFile:
+				os.remove(self.address)
+			self.boundFile=None
+			
+			
+class StateView(object):
+	#The read-only named view of a published controller: view.buttons.trigger(), view.toggles.flaps(), view.hats.coolie(), view.axes.left()
+	
+	def __init__(self,subscriber,schema):
+		self.name=schema['name']
+		self.buttons=_ViewControls('buttons')
+		self.toggles=_ViewControls('toggles')
+		self.hats=_ViewControls('hats')
+		self.axes=_ViewControls('axes')
+		for name,friendlyButtonID in schema['buttons'].items():
+			self.buttons.add(name,_ViewButton(subscriber,friendlyButtonID-1))
+		for id,entry in enumerate(schema['states']):
+			control=_ViewState(subscriber,id,entry['stateNames'])
+			for name in entry['names']:
+				getattr(self,entry['type']).add(name,control)
+		for id,entry in enumerate(schema['axes']):
+			control=_ViewAxis(subscriber,id,STATE_AXIS_SCALE if entry['shaped'] else None)
+			for name in entry['names']:
+				self.axes.add(name,control)
+				
+				
+class _ViewControls(object):
+	
+	def __init__(self,controlType):
+		self._controlType=controlType
+		self._controls={}
+		
+	def add(self,name,control):
+		self._controls[name]=control
+		
+	def __getattr__(self,name):
+		try:
+			return self.__dict__['_controls'][name]
+		except KeyError:
+			raise AttributeError('the published controller has no %s called %r' % (self._controlType,name))
+			
+	def names(self):
+		return sorted(self._controls)
+		
+		
+class _ViewButton(object):
+	__slots__=('subscriber','bit')
+	
+	def __init__(self,subscriber,zeroIndexedButtonID):
+		self.subscriber=subscriber
+		self.bit=1<<zeroIndexedButtonID
+		
+	def __call__(self):
+		return self.subscriber.buttonBits & self.bit != 0
+		
+		
+class _ViewState(object):
+	__slots__=('subscriber','id','stateNames')
+	
+	def __init__(self,subscriber,id,stateNames):
+		self.subscriber=subscriber
+		self.id=id
+		self.stateNames=stateNames	#naming strategy -> the name of each state, by its index
+		
+	def getStateIndex(self):
+		return self.subscriber.stateIndexes[self.id]
+		
+	def __call__(self,namingStrategy=''):
+		try:
+			names=self.stateNames[namingStrategy]
+		except KeyError:
+			names=self.stateNames[namingStrategy.upper()]
+		return names[self.subscriber.stateIndexes[self.id]]
+		
+		
+class _ViewAxis(object):
+	__slots__=('subscriber','id','scale')
+	
+	def __init__(self,subscriber,id,scale):
+		self.subscriber=subscriber
+		self.id=id
+		self.scale=scale	#None for raw values
+		
+	def __call__(self):
+		value=self.subscriber.axisValues[self.id]
+		if self.scale is None:
+			return value
+		return value/float(self.scale)
+		
 		
 class NamedController(object):
 
 	#This maps plural, 'friendly' class names to real class names
 	controlTypesMap={'buttons':'NamedButton', 'toggles':'NamedToggle', 'axes':'NamedAxis', 'hats':'HatFactory' }
 	
+	#the range of raw values the device reports for its axes and sliders (this is FreePIE's default)
+	axisRange=(-1000,1000)
+	
+	#the names of the toggle and button-hat state names in each definition list, eg 'flaps': {0: ['MVR','MIDDLE'], ...}
+	namingStrategies={'SIMPLE':0, 'AUTHENTIC':1}
+	defaultNamingStrategy='SIMPLE'
 	
+	@classmethod
+	def compileProfile(cls):
+		#Validate this class's definitions and compile them into lookup tables, masks and alias maps.
+		#This only happens once per class - every controller of the same class shares the result.
+		if '_compiledProfile' not in cls.__dict__:
+			cls._compiledProfile=CompiledProfile(cls.__name__,
+				{'buttons':cls.buttons, 'toggles':cls.toggles, 'axes':cls.axes, 'hats':cls.hats},
+				cls.namingStrategies,cls.defaultNamingStrategy,cls.axisRange)
+		return cls._compiledProfile
 	
-	def __init__(self,controller=None):
+	
+	
+	def __init__(self,controller=None,historyLength=20,clock=None):
 		
 		self.controller=controller
+		
+		#the time is read from the clock once per frame, by poll(), and shared by every control
+		self.clock=clock or monotonic
+		
+		#one preallocated ring buffer holds the press/release history of every control on this controller.
+		#historyLength is how many presses (and releases) each control remembers - bad things will happen with stuff like checkMorseLog() if it's too low!
+		self.eventLog=EventLog(historyLength)
 					
 		self.defined_controls={'buttons':self.buttons, 'toggle':self.toggles, 'axis':self.axes, 'hat':self.hats }				
+		
+		self.profile=self.compileProfile()
 
 		#currently, the static class variables like .buttons and .toggles will have been populated into the object, containing the definitions of those controls.
 		
 		#for each controlType, we're going to create a ControlFactory object, which will create/find/store the actual Controls of that type, and  hold the definitions,
 		#and that Factory will live at self.buttons, self.toggles etc, instead of the definitions that were there previously
 		
-		for controlType,className in self.controlTypesMap.iteritems():
+		for controlType,className in self.controlTypesMap.items():
 			self.__dict__[controlType] = ControlFactory(parent=self, controlType=controlType, controlTypeDefinition=getattr(self,controlType), targetClassName=className )
 		
+		#Work out, once, everything that poll() will need to read from the device each frame.
+		#Until poll() is first called, the controls fall back to reading the device directly, so old scripts carry on working unchanged.
+		self.tickMode=False
+		self.frame=0
+		self.buttonBits=0
+		self.previousButtonBits=0
+		self.pressedBits=0	#buttons that were pressed at some point during the last frame
+		self.timeNow=self.clock()
+		self.recorder=None
+		self.publisher=None
+		self.sampler=None
+		self.instrumentation=None
+		self.diagnosticsPublisher=None
+		self.rules=RuleEngine(self)
+		self.gestures=GestureRecognizer(self)
+		self.macros=MacroScheduler(self)
+		self._allocateSnapshot()
+		
+		#The edge engine: poll() diffs each frame's button bits against the last frame's, and tells only the buttons that changed.
+		self.buttonControls={}	#zeroIndexedButtonID -> [NamedButton, ...]
+		self.edgeSubscribers={}	#zeroIndexedButtonID -> [callback, ...]
+		self.allEdgeSubscribers=[]
+		
+		#toggles and hats whose state changes poll() keeps track of - button groups by the bits they use, and POV hats
+		self.trackedGroups={}	#zeroIndexedButtonID -> [NamedButtonGroup, ...]
+		self.trackedMask=0
+		self.trackedPOVs=[]
+		
+		#create every named button, toggle and hat up front, so that the edge engine keeps timings for all of them from the first frame,
+		#not just for the ones the script happens to have used so far.  Controls read their device as they're created, so a controller
+		#made without one (to look at its profile, say) leaves them until they're asked for.
+		if controller is not None:
+			for name in self.defined_controls['buttons']:
+				getattr(self.buttons,name)
+			for name in self.defined_controls['toggle']:
+				getattr(self.toggles,name)
+			for name in self.defined_controls['hat']:
+				getattr(self.hats,name)
+		
+	def _allocateSnapshot(self):
+		#the layout of the snapshot (which buttons, axes and POVs poll() reads, and where it puts them) comes from the compiled profile
+		profile=self.profile
+		self.pollButtons=profile.pollButtons
+		self.axisSlots=profile.axisSlots
+		self.pollAxes=profile.pollAxes
+		self.axisValues=[0]*len(self.pollAxes)
+		
+		#each controller needs its own copy of the axis pipelines, for their smoothing, but they all share the baked lookup tables
+		self.axisPipelines=dict( (key,pipeline.instance()) for key,pipeline in profile.axisPipelines.items() )
+		self.pollPipelines=tuple(sorted(self.axisPipelines.values(), key=lambda pipeline: pipeline.shapedSlot))
+		self.shapedAxisValues=[0.0]*len(self.pollPipelines)
+		
+		self.pollPOVs=profile.pollPOVs
+		self.povValues=[-1]*(max(self.pollPOVs)+1 if self.pollPOVs else 0)
+		
+	def poll(self):
+		#Read every defined button, axis, slider and POV exactly once, into a compact snapshot that all the named controls then read from.
+		#Call this once at the top of each FreePIE frame, before using any of the controls.
+		controller=self.controller
+		
+		#the sampler's queue is taken before the clock is read, so that every edge in it is timestamped no later than this frame
+		edges=None if self.sampler is None else self.sampler.drain()
+		self.timeNow=self.clock()
+		firstFrame=not self.tickMode
+		
+		if edges is None:
+			getDown=controller.getDown
+			buttonBits=0
+			for zeroIndexedButtonID,bit in self.pollButtons:
+				if getDown(zeroIndexedButtonID):
+					buttonBits|=bit
+			if self.tickMode:
+				self.previousButtonBits=self.buttonBits
+			else:
+				#first frame - compare against whatever the existing buttons last saw, and treat everything else as unchanged
+				self.previousButtonBits=buttonBits
+				for zeroIndexedButtonID,buttons in self.buttonControls.items():
+					bit=1<<zeroIndexedButtonID
+					self.previousButtonBits&=~bit
+					if buttons[0].downPreviously:
+						self.previousButtonBits|=bit
+				self.tickMode=True
+			self.pressedBits=buttonBits & ~self.previousButtonBits
+		else:
+			#the sampler thread has been watching the buttons in between frames - replay what it saw, in order
+			self.previousButtonBits=buttonBits=self.buttonBits
+			self.pressedBits=touchedBits=0
+			for zeroIndexedButtonID,downNow,timeNow in edges:
+				bit=1<<zeroIndexedButtonID
+				touchedBits|=bit
+				if downNow:
+					buttonBits|=bit
+					self.pressedBits|=bit
+				else:
+					buttonBits&=~bit
+		self.buttonBits=buttonBits
+		
+		axisValues=self.axisValues
+		for slot,source in self.pollAxes:
+			if isinstance(source,int):
+				axisValues[slot]=controller.sliders[source]
+			else:
+				axisValues[slot]=getattr(controller,source)
+		
+		#all of the shaped axes are processed together, each costing a table lookup (plus smoothing, if it has any)
+		shapedAxisValues=self.shapedAxisValues
+		for pipeline in self.pollPipelines:
+			shapedAxisValues[pipeline.shapedSlot]=pipeline.process(axisValues[pipeline.rawSlot],self.timeNow)
+		
+		povValues=self.povValues
+		for index in self.pollPOVs:
+			povValues[index]=controller.pov[index]
+		
+		self.frame+=1
+		
+		if self.recorder is not None:
+			self.recorder.write()
+		
+		#find the rules (and layer selectors) that read something which changed this frame - before the edges go out, so that
+		#a button whose layer was changed in the same frame goes to the new layer
+		changedBits=self.previousButtonBits ^ buttonBits if edges is None else touchedBits
+		self.rules.mark(changedBits)
+		
+		if edges is None:
+			if changedBits:
+				self._dispatchEdges(changedBits)
+		else:
+			#each edge keeps the time the sampler saw it, so even a tap shorter than a frame is logged with its real duration
+			for zeroIndexedButtonID,downNow,timeNow in edges:
+				self._dispatchEdge(zeroIndexedButtonID,downNow,timeNow)
+			self.sampler.recycle(edges)
+		
+		#toggles and hats only need looking at if one of their buttons changed (or, for POV hats, their angle)
+		trackedBits=self.trackedMask if firstFrame else changedBits & self.trackedMask
+		if trackedBits:
+			self._updateTrackedGroups(trackedBits)
+		for hat in self.trackedPOVs:
+			#an angle that isn't one of the hat's positions (a diagonal on a four way hat, say) isn't a change of state - the hat keeps
+			#the state it was in, so that reading odd values from the device never stops poll()
+			angle=povValues[hat.index]
+			if angle!=hat.state and angle in hat.stateIndexes:
+				hat._changeState(angle,self.timeNow)
+		
+		if self.publisher is not None:
+			self.publisher.write()
+		
+		#gestures that complete by time passing rather than by an edge (like a long hold)
+		if self.gestures.deadlines:
+			self.gestures.expire(self.timeNow)
+		
+		#timed output (see MacroScheduler) that has come due
+		if self.macros.pending:
+			self.macros.advance(self.timeNow)
+		
+		#only the rules that read something which changed this frame get evaluated
+		self.rules.evaluate()
+		
+		if self.diagnosticsPublisher is not None and self.timeNow>=self.diagnosticsPublisher.nextPublishTime:
+			self.diagnosticsPublisher.publish(self.timeNow)
+		
+	def bind(self,inputs,condition,onTrue=None,onFalse=None):
+		#Declare a rule: condition() is re-evaluated only in frames where one of its inputs (buttons, toggles, hats or axes) changed,
+		#and onTrue() or onFalse() is called when its result changes.  Inputs can be from other controllers too.  Needs poll() to be called each frame.
+		rule=Rule(inputs,condition,onTrue,onFalse)
+		for parent in set( input.parent for input in rule.inputs ):
+			parent.rules.add(rule)
+		return rule
+		
+	def unbind(self,rule):
+		for parent in set( input.parent for input in rule.inputs ):
+			parent.rules.remove(rule)
+			
+	def addLayers(self,selector,inputs=None,onChange=None):
+		#Declare a set of layers, like the pinky switch choosing what the stick's hat buttons do.  selector is a toggle, hat or button
+		#(whose value names the active layer), or a function of the controls in inputs (which returns the name of the active layer).
+		#Bind buttons in each layer with layers.bind(layer, button, onPress, onRelease).  onChange(layer) is called when the layer changes.
+		if inputs is None:
+			inputs=(selector,)
+		layers=LayerSet(selector,inputs,onChange)
+		for parent in set( input.parent for input in layers.inputs ):
+			parent.rules.add(layers)
+		return layers
+		
+	def removeLayers(self,layers):
+		layers.clear()
+		self.unbind(layers)
+			
+	def _allControls(self):
+		controls=[]
+		for controlType in self.controlTypesMap:
+			controls.extend(self.__dict__[controlType].controlsByKey.values())
+		return controls
+		
+	def enableInstrumentation(self,budget=0.004,worstOffenders=5):
+		#Count calls to, and time spent in, every control's accessors, and check each frame's total against <budget> seconds.
+		#The controls are switched to instrumented versions of their classes, so there's no cost at all while this is turned off.
+		#diagnostics.watch(throttle.instrumentation.summary()) shows the results.
+		if self.instrumentation is None:
+			self.instrumentation=Instrumentation(budget,worstOffenders)
+			for control in self._allControls():
+				self.instrumentation.instrument(control)
+			self.poll=self.instrumentation.instrumentPoll(self)
+		return self.instrumentation
+		
+	def disableInstrumentation(self):
+		if self.instrumentation is not None:
+			for control in self._allControls():
+				self.instrumentation.uninstrument(control)
+			del self.poll
+			self.instrumentation=None
+		
+	def startDiagnostics(self,output,rate=10):
+		#Show values for debugging without working them out every frame: register each control or expression once, with watch(), and
+		#output(name, text) is called for only the ones that changed, at most <rate> times a second.
+		#	diagnosticsPublisher=throttle.startDiagnostics(lambda name,text: diagnostics.debug('%s: %s' % (name,text)), rate=5)
+		#	diagnosticsPublisher.watch('flaps', throttle.toggles.flaps)
+		#	diagnosticsPublisher.watch('eac morse', throttle.buttons.eac.morseLog)
+		#	diagnosticsPublisher.watch('eject', lambda: throttle.toggles.eac()=='ARM' and throttle.buttons.autopilot())
+		if self.diagnosticsPublisher is None:
+			self.diagnosticsPublisher=DiagnosticsPublisher(output,rate)
+		else:
+			self.diagnosticsPublisher.output=output
+			self.diagnosticsPublisher.setRate(rate)
+		return self.diagnosticsPublisher
+		
+	def stopDiagnostics(self):
+		self.diagnosticsPublisher=None
+		
+	def startRecording(self,path):
+		#Record every frame that poll() reads to a compact binary file, which ReplayController can play back
+		self.stopRecording()
+		self.recorder=InputRecorder(self,path)
+		
+	def stopRecording(self):
+		if self.recorder is not None:
+			self.recorder.close()
+			self.recorder=None
+			
+	def startPublishing(self,address,keyframeInterval=250,axisThreshold=0.001,schemaInterval=1000):
+		#Stream this controller's state to other processes (cockpit displays, telemetry...) as compact datagrams, which StateSubscriber
+		#turns back into a read-only named view.  address is a (host, port) pair for UDP, or a path for a Unix datagram socket.
+		#Only what changed is sent each frame (axes once they've moved by more than <axisThreshold> of their range), with everything,
+		#every <keyframeInterval> frames so that subscribers recover from lost datagrams.  The names are only sent when publishing starts and
+		#every <schemaInterval> frames after that (4 seconds at 250Hz), so that's how long a subscriber that starts later might wait - except
+		#on a Unix socket, where the publisher can tell nobody is listening yet and sends the names as soon as somebody is.
+		self.stopPublishing()
+		self.publisher=StatePublisher(self,address,keyframeInterval,axisThreshold,schemaInterval)
+		
+	def stopPublishing(self):
+		if self.publisher is not None:
+			self.publisher.close()
+			self.publisher=None
+		
+	def now(self):
+		#the time of the current frame, once poll() is being used - otherwise, the time right now
+		if self.tickMode:
+			return self.timeNow
+		return self.clock()
+		
+	def _dispatchEdges(self,changedBits):
+		#only the bits that actually changed are visited, so the cost of this depends on how many buttons moved, not how many there are
+		timeNow=self.timeNow
+		buttonBits=self.buttonBits
+		while changedBits:
+			bit=changedBits & -changedBits
+			changedBits^=bit
+			self._dispatchEdge(bit.bit_length()-1,buttonBits & bit != 0,timeNow)
+			
+	def _dispatchEdge(self,zeroIndexedButtonID,downNow,timeNow):
+		for button in self.buttonControls.get(zeroIndexedButtonID,()):
+			if downNow:
+				button._onPressed(timeNow)
+			else:
+				button._onReleased(timeNow)
+			button.downPreviously=downNow
+		
+		for callback in self.edgeSubscribers.get(zeroIndexedButtonID,()):
+			callback(zeroIndexedButtonID+1,downNow,timeNow)
+		for callback in self.allEdgeSubscribers:
+			callback(zeroIndexedButtonID+1,downNow,timeNow)
+			
+	def _updateTrackedGroups(self,trackedBits):
+		buttonBits=self.buttonBits
+		timeNow=self.timeNow
+		while trackedBits:
+			bit=trackedBits & -trackedBits
+			trackedBits^=bit
+			for group in self.trackedGroups[bit.bit_length()-1]:
+				#a group that has several of its buttons change in one frame is visited for each, but only changes state once
+				state=group.rawValues[buttonBits & group.mask]
+				if state!=group.state:
+					group._changeState(state,timeNow)
+					
+	def _registerTracked(self,control):
+		if isinstance(control,NamedPOVHat):
+			self.trackedPOVs.append(control)
+			return
+		for zeroIndexedButtonID,bit in control.buttons:
+			self.trackedGroups.setdefault(zeroIndexedButtonID,[]).append(control)
+			self.trackedMask|=bit
+			
+	def startSampler(self,rate=1000):
+		#Watch the buttons from a background thread, <rate> times a second, so that presses shorter than a frame aren't missed
+		#and press timings don't depend on the frame rate.  poll() then replays the edges the sampler saw, each with its own timestamp.
+		#This only helps if the device reads the hardware when it's asked - FreePIE's own joystick objects only update once per script frame.
+		self.stopSampler()
+		if not self.tickMode:
+			self.poll()
+		self.sampler=InputSampler(self,rate)
+		self.sampler.start()
+		
+	def stopSampler(self):
+		if self.sampler is not None:
+			self.sampler.stop()
+			#anything it saw since the last frame still counts
+			self.poll()
+			self.sampler=None
+	
+	def _registerButton(self,button):
+		self.buttonControls.setdefault(button.zeroIndexedButtonID,[]).append(button)
+		
+	def subscribe(self,callback,control=None):
+		#Ask to be told about button edges, instead of polling buttons every frame.
+		#callback(friendlyButtonID, downNow, timeNow) is called from poll() whenever a button is pressed or released.
+		#Pass a button, toggle or button-hat as control to hear only about the buttons it uses, or leave it out to hear about every button.
+		if control is None:
+			self.allEdgeSubscribers.append(callback)
+			return
+		for zeroIndexedButtonID in _zeroIndexedButtonIDs(control):
+			self.edgeSubscribers.setdefault(zeroIndexedButtonID,[]).append(callback)
+	
+	def unsubscribe(self,callback,control=None):
+		if control is None:
+			self.allEdgeSubscribers.remove(callback)
+			return
+		for zeroIndexedButtonID in _zeroIndexedButtonIDs(control):
+			self.edgeSubscribers[zeroIndexedButtonID].remove(callback)
+		
+		
+class Rule(object):
+	#A binding declared with NamedController.bind()
+	
+	def __init__(self,inputs,condition,onTrue=None,onFalse=None):
+		self.inputs=tuple(inputs)
+		self.condition=condition
+		self.onTrue=onTrue
+		self.onFalse=onFalse
+		self.result=False
+		self.dirty=True	#evaluate it in the first frame after it's bound
+		
+	def evaluate(self):
+		self.dirty=False
+		result=bool(self.condition())
+		if result!=self.result:
+			self.result=result
+			action=self.onTrue if result else self.onFalse
+			if action is not None:
+				action()
+		
+		
+class RuleEngine(object):
+	#Indexes each controller's rules by the inputs they read - buttons by bit, hats by POV index and axes by snapshot slot -
+	#so that each frame, only the rules touched by something that changed are evaluated.  An idle frame costs a mask test.
+	
+	def __init__(self,parent):
+		self.parent=parent
+		self.buttonMask=0
+		self.rulesByBit={}	#zeroIndexedButtonID -> [Rule, ...]
+		self.rulesByPOV={}	#POV index -> [Rule, ...]
+		self.rulesByAxisSlot={}	#raw axis slot -> [Rule, ...]
+		self.povValues={}	#the value of each watched POV when we last looked
+		self.axisValues={}	#the value of each watched axis when we last looked
+		self.dirty=[]
+		
+	def _dependencies(self,rule):
+		#the (index, key) pairs of the inputs of this rule which belong to this controller
+		for input in rule.inputs:
+			if input.parent is not self.parent:
+				continue
+			if isinstance(input,NamedPOVHat):
+				yield self.rulesByPOV,input.index
+			elif isinstance(input,NamedAxis):
+				yield self.rulesByAxisSlot,input.slot
+			else:
+				for zeroIndexedButtonID in _zeroIndexedButtonIDs(input):
+					yield self.rulesByBit,zeroIndexedButtonID
+		
+	def add(self,rule):
+		for index,key in self._dependencies(rule):
+			rules=index.setdefault(key,[])
+			if rule not in rules:
+				rules.append(rule)
+		self._reindex()
+		if rule not in self.dirty:
+			self.dirty.append(rule)
+		
+	def remove(self,rule):
+		for index,key in self._dependencies(rule):
+			if rule in index.get(key,()):
+				index[key].remove(rule)
+				if not index[key]:
+					del index[key]
+		self._reindex()
+		if rule in self.dirty:
+			self.dirty.remove(rule)
+		
+	def _reindex(self):
+		self.buttonMask=0
+		for zeroIndexedButtonID in self.rulesByBit:
+			self.buttonMask|=1<<zeroIndexedButtonID
+		self.povValues=dict( (index,self.parent.povValues[index]) for index in self.rulesByPOV )
+		self.axisValues=dict( (slot,self.parent.axisValues[slot]) for slot in self.rulesByAxisSlot )
+		
+	def _mark(self,rules):
+		for rule in rules:
+			if not rule.dirty:
+				rule.dirty=True
+				self.dirty.append(rule)
+		
+	def mark(self,changedBits):
+		#mark the rules that read something which changed this frame
+		changedBits&=self.buttonMask
+		while changedBits:
+			bit=changedBits & -changedBits
+			changedBits^=bit
+			self._mark(self.rulesByBit[bit.bit_length()-1])
+		
+		if self.rulesByPOV:
+			povValues=self.parent.povValues
+			for index,rules in self.rulesByPOV.items():
+				if povValues[index]!=self.povValues[index]:
+					self.povValues[index]=povValues[index]
+					self._mark(rules)
+		if self.rulesByAxisSlot:
+			axisValues=self.parent.axisValues
+			for slot,rules in self.rulesByAxisSlot.items():
+				if axisValues[slot]!=self.axisValues[slot]:
+					self.axisValues[slot]=axisValues[slot]
+					self._mark(rules)
+		
+	def evaluate(self):
+		#evaluate the marked rules (any that were already evaluated early, like layer selectors, are skipped)
+		if self.dirty:
+			dirty=self.dirty
+			self.dirty=[]
+			for rule in dirty:
+				if rule.dirty:
+					rule.evaluate()
+		
+		
+class LayerSet(object):
+	#Layers of button bindings, one of which is active at a time - see NamedController.addLayers().
+	#Each layer's bindings are compiled into a table per controller, indexed by button, so switching layers swaps one reference
+	#and a press costs one index into the active table.  The selector is indexed by the RuleEngine like a binding's condition,
+	#so it's only re-evaluated when one of its inputs changes.
+	
+	def __init__(self,selector,inputs,onChange=None):
+		self.selector=selector
+		self.inputs=tuple(inputs)
+		self.onChange=onChange
+		self.dirty=True	#for the RuleEngine
+		
+		self.bindings={}	#layer -> {(controller, zeroIndexedButtonID): (onPress, onRelease)}
+		self.controllers=[]	#every controller with a bound button, in the order they were first bound
+		self.tables={}	#layer -> [one list per controller, indexed by zeroIndexedButtonID, of (onPress, onRelease) or None]
+		self.held=[]	#per controller, indexed by zeroIndexedButtonID: the onRelease of the layer that handled each held button's press
+		self.dispatchers=[]	#per controller, the edge subscriber that dispatches its bound buttons
+		self.subscribed=set()	#(controller index, zeroIndexedButtonID)
+		
+		self.layer=None
+		self._compile()
+		self.evaluate()
+		
+	def bind(self,layer,button,onPress=None,onRelease=None):
+		#In <layer>, pressing <button> calls onPress() and releasing it calls onRelease().  Bindings in layer None apply in every layer that
+		#doesn't bind that button itself.  A release always goes to the layer that handled the press, so switching layers while a button is
+		#held never leaves a key stuck down.
+		if not isinstance(button,NamedButton):
+			raise ValueError('layers can only bind buttons, not %r' % button.name)
+		if button.parent not in self.controllers:
+			self.controllers.append(button.parent)
+			self.held.append([])
+			self.dispatchers.append(functools.partial(self._onEdge,len(self.controllers)-1))
+		self.bindings.setdefault(layer,{})[(button.parent,button.zeroIndexedButtonID)]=(onPress,onRelease)
+		self._compile()
+		
+	def unbind(self,layer,button):
+		self.bindings.get(layer,{}).pop((button.parent,button.zeroIndexedButtonID),None)
+		self._compile()
+		
+	def clear(self):
+		self.bindings={}
+		self._compile()
+		
+	def _compileTable(self,layer):
+		#the base layer's bindings, overlaid with <layer>'s own
+		sizes=[ len(held) for held in self.held ]
+		table=[ [None]*size for size in sizes ]
+		for bindings in (self.bindings.get(None,{}),self.bindings.get(layer,{})) if layer is not None else (self.bindings.get(None,{}),):
+			for (controller,zeroIndexedButtonID),actions in bindings.items():
+				table[self.controllers.index(controller)][zeroIndexedButtonID]=actions
+		return table
+		
+	def _compile(self):
+		#size each controller's tables to its highest bound button
+		for controllerIndex,controller in enumerate(self.controllers):
+			size=1+max([ zeroIndexedButtonID for bindings in self.bindings.values() for (boundController,zeroIndexedButtonID) in bindings if boundController is controller ] or [-1])
+			held=self.held[controllerIndex]
+			held.extend([None]*(size-len(held)))
+		
+		self.tables=dict( (layer,self._compileTable(layer)) for layer in self.bindings )
+		self.tables[None]=self._compileTable(None)
+		self.active=self.tables.get(self.layer,self.tables[None])
+		
+		#listen to exactly the buttons that are bound in some layer
+		wanted=set( (self.controllers.index(controller),zeroIndexedButtonID) for bindings in self.bindings.values() for (controller,zeroIndexedButtonID) in bindings )
+		for controllerIndex,zeroIndexedButtonID in wanted-self.subscribed:
+			self.controllers[controllerIndex].edgeSubscribers.setdefault(zeroIndexedButtonID,[]).append(self.dispatchers[controllerIndex])
+		for controllerIndex,zeroIndexedButtonID in self.subscribed-wanted:
+			self.controllers[controllerIndex].edgeSubscribers[zeroIndexedButtonID].remove(self.dispatchers[controllerIndex])
+		self.subscribed=wanted
+		
+	def evaluate(self):
+		self.dirty=False
+		layer=self.selector()
+		if layer!=self.layer:
+			self.layer=layer
+			self.active=self.tables.get(layer,self.tables[None])
+			if self.onChange is not None:
+				self.onChange(layer)
+				
+	def _onEdge(self,controllerIndex,friendlyButtonID,downNow,timeNow):
+		if self.dirty:
+			#the selector's inputs changed this frame too - the edge belongs to the new layer
+			self.evaluate()
+		zeroIndexedButtonID=friendlyButtonID-1
+		held=self.held[controllerIndex]
+		if downNow:
+			actions=self.active[controllerIndex][zeroIndexedButtonID]
+			if actions is None:
+				return
+			onPress,held[zeroIndexedButtonID]=actions
+			if onPress is not None:
+				onPress()
+		else:
+			onRelease=held[zeroIndexedButtonID]
+			held[zeroIndexedButtonID]=None
+			if onRelease is not None:
+				onRelease()
+				
+				
+class GestureRecognizer(object):
+	#Recognises chords, multi-taps, holds and sequences from the button edge stream, as it happens.
+	#Each gesture is a small state machine, indexed by the buttons it uses, so an edge only touches the gestures of the button that moved
+	#and costs the same however much history there is.  Gestures that complete by time passing (holds, or a multi-tap waiting to be sure no
+	#more taps follow) go on a heap of deadlines, so an idle frame costs one check.  Needs poll() to be called each frame.
+	#
+	#	doubleTap=throttle.gestures.multiTap(throttle.buttons.autopilot,taps=2)
+	#	if doubleTap(): ...		#True once for each double tap
+	
+	def __init__(self,parent):
+		self.parent=parent
+		self.gesturesByButton={}	#zeroIndexedButtonID -> (Gesture, ...)
+		self.deadlines=[]	#a heap of (time, serial, Gesture)
+		self.serial=0
+		
+	def chord(self,buttons,window=0.05,callback=None):
+		#every one of <buttons> held down together, with all of the presses within <window> seconds
+		return self.add(Chord(buttons,window,callback))
+		
+	def sequence(self,buttons,window=1.0,callback=None):
+		#<buttons> pressed one after another, in order, all within <window> seconds (eg china_forward then boatswitch_back).
+		#Presses of buttons that aren't in the sequence don't interrupt it.
+		return self.add(Sequence(buttons,window,callback))
+		
+	def multiTap(self,button,taps=2,interval=0.3,tapDuration=0.3,wait=False,callback=None):
+		#<taps> short presses (each no longer than <tapDuration>) with no more than <interval> seconds between them.
+		#Recognised as the last tap is released - or with wait=True, only once <interval> has passed with no further tap,
+		#so that a double tap and a triple tap on the same button don't both fire.
+		return self.add(MultiTap(button,taps,interval,tapDuration,wait,callback))
+		
+	def hold(self,button,duration=0.5,taps=0,interval=0.3,tapDuration=0.3,callback=None):
+		#the button held down for <duration> seconds, recognised while it's still held.  With taps=1 it's tap-then-hold, and so on.
+		return self.add(Hold(button,duration,taps,interval,tapDuration,callback))
+		
+	def press(self,button,minDuration=0.0,maxDuration=None,callback=None):
+		#a press whose length is at least <minDuration> and less than <maxDuration>, recognised on release.
+		#Use several to sort presses into classes, eg short=press(b,0,0.5), long=press(b,0.5,2), veryLong=press(b,2)
+		return self.add(Press(button,minDuration,maxDuration,callback))
+		
+	def add(self,gesture):
+		for button in gesture.buttons:
+			if button.parent is not self.parent:
+				raise ValueError('all of the buttons in a gesture must be on the same controller')
+		gesture.recognizer=self
+		for zeroIndexedButtonID in set(gesture.zeroIndexedButtonIDs):
+			if zeroIndexedButtonID not in self.gesturesByButton:
+				self.gesturesByButton[zeroIndexedButtonID]=()
+				self.parent.edgeSubscribers.setdefault(zeroIndexedButtonID,[]).append(self._onEdge)
+			self.gesturesByButton[zeroIndexedButtonID]+=(gesture,)
+		return gesture
+		
+	def remove(self,gesture):
+		gesture.deadlineSerial=None
+		for zeroIndexedButtonID in set(gesture.zeroIndexedButtonIDs):
+			gestures=tuple( other for other in self.gesturesByButton.get(zeroIndexedButtonID,()) if other is not gesture )
+			if gestures:
+				self.gesturesByButton[zeroIndexedButtonID]=gestures
+			elif zeroIndexedButtonID in self.gesturesByButton:
+				del self.gesturesByButton[zeroIndexedButtonID]
+				self.parent.edgeSubscribers[zeroIndexedButtonID].remove(self._onEdge)
+		
+	def schedule(self,gesture,time):
+		#a gesture only ever has one deadline - scheduling another replaces it
+		self.serial+=1
+		gesture.deadlineSerial=self.serial
+		heapq.heappush(self.deadlines,(time,self.serial,gesture))
+		
+	def expire(self,timeNow):
+		deadlines=self.deadlines
+		while deadlines and deadlines[0][0]<=timeNow:
+			time,serial,gesture=heapq.heappop(deadlines)
+			#deadlines that were cancelled or replaced are just skipped
+			if gesture.deadlineSerial==serial:
+				gesture.deadlineSerial=None
+				gesture.onDeadline(time)
+		
+	def _onEdge(self,friendlyButtonID,downNow,timeNow):
+		#a deadline that passed before this edge happened comes first (the sampler can deliver several edges per frame)
+		if self.deadlines and self.deadlines[0][0]<=timeNow:
+			self.expire(timeNow)
+		zeroIndexedButtonID=friendlyButtonID-1
+		for gesture in self.gesturesByButton[zeroIndexedButtonID]:
+			gesture.onEdge(zeroIndexedButtonID,downNow,timeNow)
+		
+		
+class Gesture(object):
+	#The base of the gestures made by GestureRecognizer.  Each recognised occurrence is counted once, and calls callback(gesture).
+	
+	def __init__(self,buttons,callback=None):
+		self.buttons=tuple(buttons)
+		if not self.buttons:
+			raise ValueError('a gesture needs at least one button')
+		self.zeroIndexedButtonIDs=tuple( button.zeroIndexedButtonID for button in self.buttons )
+		self.callback=callback
+		self.recognizer=None
+		self.deadlineSerial=None
+		self.count=0	#how many times it has been recognised
+		self.reportedCount=0
+		self.lastRecognizedTime=None
+		
+	def getRecognized(self):
+		#True once for each time the gesture was recognised - so if it was recognised twice since this was last asked, the next two calls are True
+		if self.reportedCount==self.count:
+			return False
+		self.reportedCount+=1
+		return True
+		
+	__call__=getRecognized
+	
+	def _recognize(self,timeNow):
+		self.count+=1
+		self.lastRecognizedTime=timeNow
+		if self.callback is not None:
+			self.callback(self)
+			
+	def _schedule(self,time):
+		self.recognizer.schedule(self,time)
+		
+	def _cancel(self):
+		self.deadlineSerial=None
+		
+	def onEdge(self,zeroIndexedButtonID,downNow,timeNow):
+		pass
+		
+	def onDeadline(self,timeNow):
+		pass
+		
+		
+class Chord(Gesture):
+	
+	def __init__(self,buttons,window=0.05,callback=None):
+		Gesture.__init__(self,buttons,callback)
+		self.window=window
+		self.pressTimes=dict( (zeroIndexedButtonID,None) for zeroIndexedButtonID in self.zeroIndexedButtonIDs )	#None while it's up
+		self.downCount=0
+		self.fired=False	#so that it's recognised once per chord, not again for every bounce while it's held
+		
+	def onEdge(self,zeroIndexedButtonID,downNow,timeNow):
+		if downNow:
+			if self.pressTimes[zeroIndexedButtonID] is None:
+				self.downCount+=1
+			self.pressTimes[zeroIndexedButtonID]=timeNow
+			if self.downCount==len(self.pressTimes) and not self.fired:
+				if timeNow-min(self.pressTimes.values())<=self.window:
+					self.fired=True
+					self._recognize(timeNow)
+		else:
+			if self.pressTimes[zeroIndexedButtonID] is not None:
+				self.downCount-=1
+			self.pressTimes[zeroIndexedButtonID]=None
+			self.fired=False
+			
+			
+class Sequence(Gesture):
+	
+	def __init__(self,buttons,window=1.0,callback=None):
+		Gesture.__init__(self,buttons,callback)
+		self.window=window
+		
+		#the sequence is compiled into a KMP automaton over its own buttons, so that overlapping attempts (like a, a, b for a sequence of a, b)
+		#are matched correctly, one step per press
+		symbols={}
+		for zeroIndexedButtonID in self.zeroIndexedButtonIDs:
+			symbols.setdefault(zeroIndexedButtonID,len(symbols))
+		pattern=[ symbols[zeroIndexedButtonID] for zeroIndexedButtonID in self.zeroIndexedButtonIDs ]
+		transitions=[ [0]*len(symbols) for step in pattern ]
+		transitions[0][pattern[0]]=1
+		fallback=0
+		for step in range(1,len(pattern)):
+			transitions[step]=list(transitions[fallback])
+			transitions[step][pattern[step]]=step+1
+			fallback=transitions[fallback][pattern[step]]
+		#after a complete match, carry on from the longest part of it that could start the next one
+		transitions.append(list(transitions[fallback]))
+		
+		self.symbols=symbols
+		self.transitions=transitions
+		self.state=0
+		self.pressTimes=collections.deque(maxlen=len(pattern))
+		
+	def onEdge(self,zeroIndexedButtonID,downNow,timeNow):
+		if not downNow:
+			return
+		self.pressTimes.append(timeNow)
+		self.state=self.transitions[self.state][self.symbols[zeroIndexedButtonID]]
+		if self.state==len(self.zeroIndexedButtonIDs) and timeNow-self.pressTimes[0]<=self.window:
+			self._recognize(timeNow)
+			
+			
+class MultiTap(Gesture):
+	
+	def __init__(self,button,taps=2,interval=0.3,tapDuration=0.3,wait=False,callback=None):
+		Gesture.__init__(self,(button,),callback)
+		self.taps=taps
+		self.interval=interval
+		self.tapDuration=tapDuration
+		self.wait=wait
+		self.tapCount=0
+		self.pressTime=None
+		self.releaseTime=0.0
+		
+	def onEdge(self,zeroIndexedButtonID,downNow,timeNow):
+		if downNow:
+			if self.tapCount and timeNow-self.releaseTime>self.interval:
+				self.tapCount=0
+			self.pressTime=timeNow
+			#another tap is starting, so it wasn't exactly <taps> after all
+			self._cancel()
+		elif self.pressTime is not None:
+			if timeNow-self.pressTime<=self.tapDuration:
+				self.tapCount+=1
+			else:
+				self.tapCount=0
+			self.pressTime=None
+			self.releaseTime=timeNow
+			if self.tapCount==self.taps:
+				if self.wait:
+					self._schedule(timeNow+self.interval)
+				else:
+					self.tapCount=0
+					self._recognize(timeNow)
+					
+	def onDeadline(self,timeNow):
+		self.tapCount=0
+		self._recognize(timeNow)
+		
+		
+class Hold(Gesture):
+	
+	def __init__(self,button,duration=0.5,taps=0,interval=0.3,tapDuration=0.3,callback=None):
+		Gesture.__init__(self,(button,),callback)
+		self.duration=duration
+		self.taps=taps
+		self.interval=interval
+		self.tapDuration=tapDuration
+		self.tapCount=0	#the taps before this press, up to <taps> - any more than that still count as tap-then-hold
+		self.pressTime=None
+		self.releaseTime=0.0
+		
+	def onEdge(self,zeroIndexedButtonID,downNow,timeNow):
+		if downNow:
+			if timeNow-self.releaseTime>self.interval:
+				self.tapCount=0
+			self.pressTime=timeNow
+			if self.tapCount==self.taps:
+				self._schedule(timeNow+self.duration)
+		elif self.pressTime is not None:
+			self._cancel()
+			if timeNow-self.pressTime<=self.tapDuration:
+				self.tapCount=min(self.tapCount+1,self.taps)
+			else:
+				self.tapCount=0
+			self.pressTime=None
+			self.releaseTime=timeNow
+			
+	def onDeadline(self,timeNow):
+		self.tapCount=0
+		self._recognize(timeNow)
+		
+		
+class Press(Gesture):
+	
+	def __init__(self,button,minDuration=0.0,maxDuration=None,callback=None):
+		Gesture.__init__(self,(button,),callback)
+		self.minDuration=minDuration
+		self.maxDuration=maxDuration
+		self.pressTime=None
+		
+	def onEdge(self,zeroIndexedButtonID,downNow,timeNow):
+		if downNow:
+			self.pressTime=timeNow
+		elif self.pressTime is not None:
+			duration=timeNow-self.pressTime
+			self.pressTime=None
+			if duration>=self.minDuration and (self.maxDuration is None or duration<self.maxDuration):
+				self._recognize(timeNow)
+		
+		
+class MacroScheduler(object):
+	#Runs timed actions - pressing and releasing keys on a schedule, or auto-repeating while a button is held - on the controller's clock.
+	#Actions wait in a hierarchical timer wheel of <levels> wheels of 64 slots each, the first with a slot for every <resolution> seconds
+	#and each of the others covering 64 of the slots of the one below, so scheduling and cancelling cost the same however many actions are
+	#waiting, and a frame only visits the slots it has moved through and the actions that are due.  Every action runs in the first poll()
+	#whose time has reached the action's time, so timing is exact to the frame.
+	#
+	#	throttle.macros.onPress(throttle.buttons.autopilot, [
+	#		(0.0, lambda: keyboard.setKeyDown(Key.LeftAlt)),
+	#		(0.05, lambda: keyboard.setPressed(Key.L)),
+	#		(0.1, lambda: keyboard.setKeyUp(Key.LeftAlt)),
+	#	], onCancel=lambda: keyboard.setKeyUp(Key.LeftAlt))	#each press runs it again, and releasing the button early stops it
+	#	throttle.macros.whileHeld(throttle.buttons.h3u, lambda: keyboard.setPressed(Key.PageUp), interval=0.1, delay=0.5)
+	
+	slotBits=6
+	
+	def __init__(self,parent,resolution=0.001,levels=4):
+		self.parent=parent
+		self.resolution=resolution
+		self.levels=levels
+		self.wheels=None	#made when the first action is scheduled
+		self.tick=0	#the slot the first wheel has reached, in <resolution>s since the clock's zero
+		self.pending=0	#actions waiting, not counting cancelled ones
+		self.heldMacros={}	#zeroIndexedButtonID -> [Macro, ...] to cancel when it's released
+		self.pressBindings={}	#zeroIndexedButtonID -> [function(timeNow), ...] to start a macro when it's pressed
+		
+	def after(self,delay,action,button=None):
+		#action() in <delay> seconds
+		return self.run([(delay,action)],button)
+		
+	def run(self,steps,button=None,onCancel=None,startTime=None):
+		#Each of the (delay, action) steps calls action() <delay> seconds from now.  With <button>, it's cancelled when that button is released.
+		#If it's cancelled before its last step, onCancel() is called - to release any keys it left down, say.
+		macro=Macro(self,onCancel)
+		if startTime is None:
+			startTime=self.parent.timeNow
+		for delay,action in steps:
+			macro._add(MacroTimer(startTime+delay,action,None,macro))
+		self._start(macro,button,startTime)
+		return macro
+		
+	def repeat(self,action,interval,delay=0.0,button=None,onCancel=None,startTime=None):
+		#action() in <delay> seconds, and then every <interval> seconds after that, until cancelled (or with <button>, until it's released).
+		#Repeats are timed from the first one, not from the frame they happened in, so they don't drift.
+		macro=Macro(self,onCancel)
+		if startTime is None:
+			startTime=self.parent.timeNow
+		macro._add(MacroTimer(startTime+delay,action,interval,macro))
+		self._start(macro,button,startTime)
+		return macro
+		
+	def onPress(self,button,steps,onCancel=None):
+		#run(steps) every time <button> is pressed, timed from the press, and cancelled when it's released
+		return self._bindPress(button,lambda timeNow: self.run(steps,button,onCancel,timeNow))
+		
+	def whileHeld(self,button,action,interval,delay=0.0,onCancel=None):
+		#auto-repeat: action() <delay> seconds after <button> is pressed and then every <interval> seconds, for as long as it's held
+		return self._bindPress(button,lambda timeNow: self.repeat(action,interval,delay,button,onCancel,timeNow))
+		
+	def removeBinding(self,button,binding):
+		#stop an onPress() or whileHeld() binding (any macro it already started carries on until it finishes or the button is released)
+		self.pressBindings[button.zeroIndexedButtonID].remove(binding)
+		
+	def cancelAll(self):
+		for macros in list(self.heldMacros.values()):
+			for macro in list(macros):
+				macro.cancel()
+		for level in self.wheels or ():
+			for slot in level:
+				for timer in slot:
+					if timer.action is not None:
+						timer.macro.cancel()
+						
+	def _bindPress(self,button,binding):
+		self._watch(button)
+		self.pressBindings.setdefault(button.zeroIndexedButtonID,[]).append(binding)
+		return binding
+		
+	def _watch(self,button):
+		if button.parent is not self.parent:
+			raise ValueError('%s is not on this controller' % button.name)
+		zeroIndexedButtonID=button.zeroIndexedButtonID
+		if zeroIndexedButtonID not in self.heldMacros:
+			self.heldMacros[zeroIndexedButtonID]=[]
+			self.parent.edgeSubscribers.setdefault(zeroIndexedButtonID,[]).append(self._onEdge)
+			
+	def _start(self,macro,button,startTime):
+		if button is not None:
+			self._watch(button)
+			macro.button=button
+			self.heldMacros[button.zeroIndexedButtonID].append(macro)
+		for timer in macro.timers:
+			self._schedule(timer)
+		#steps that are already due (like the first step of most macros) happen straight away, rather than a frame late - but only the
+		#ones due by the time it started: a macro started by an edge that the sampler saw part way through the frame mustn't run ahead of
+		#edges later in the same frame (like the release that cancels it), which advance it further themselves
+		if self.pending:
+			self.advance(startTime)
+			
+	def _tickOf(self,time):
+		return int(time//self.resolution)
+		
+	def _schedule(self,timer):
+		if self.wheels is None:
+			self.wheels=[ [ [] for i in range(1<<self.slotBits) ] for level in range(self.levels) ]
+		if not self.pending:
+			#the wheels haven't been turned while nothing was waiting, so catch them up first
+			self.tick=max(self.tick,self._tickOf(self.parent.timeNow))
+		timer.tick=self._tickOf(timer.time)
+		self.pending+=1
+		self._insert(timer)
+		
+	def _insert(self,timer):
+		slotBits=self.slotBits
+		delta=timer.tick-self.tick
+		if delta<=0:
+			#due already - it goes in the current slot
+			self.wheels[0][self.tick & ((1<<slotBits)-1)].append(timer)
+			return
+		for level in range(self.levels):
+			if delta < 1<<(slotBits*(level+1)):
+				self.wheels[level][(timer.tick>>(slotBits*level)) & ((1<<slotBits)-1)].append(timer)
+				return
+		#further off than the wheels reach: park it in the last wheel's slot that will be reached last, and place it again from there
+		level=self.levels-1
+		self.wheels[level][((self.tick>>(slotBits*level))-1) & ((1<<slotBits)-1)].append(timer)
+		
+	def _cascade(self,level):
+		#the wheel below has come round to its start, so spread this wheel's next slot out over the wheels below
+		index=(self.tick>>(self.slotBits*level)) & ((1<<self.slotBits)-1)
+		slot=self.wheels[level][index]
+		if slot:
+			timers=slot[:]
+			del slot[:]
+			for timer in timers:
+				if timer.action is not None:
+					self._insert(timer)
+		if index==0 and level+1<self.levels:
+			self._cascade(level+1)
+			
+	def advance(self,timeNow):
+		#run every action whose time is no later than <timeNow>, in time order
+		target=self._tickOf(timeNow)
+		mask=(1<<self.slotBits)-1
+		wheel=self.wheels[0]
+		while self.tick<target:
+			#every action in a slot that has been passed completely is due
+			self._fire(wheel[self.tick & mask],None)
+			if not self.pending:
+				self.tick=target
+				break
+			self.tick+=1
+			if self.tick & mask==0:
+				self._cascade(1)
+		#and the ones in the slot we're part way through that are due by now
+		self._fire(wheel[self.tick & mask],timeNow)
+		
+	def _fire(self,slot,timeNow):
+		while slot:
+			if timeNow is None:
+				due=slot[:]
+				del slot[:]
+			else:
+				due=[ timer for timer in slot if timer.time<=timeNow ]
+				if not due:
+					return
+				slot[:]=[ timer for timer in slot if timer.time>timeNow ]
+			due.sort(key=lambda timer: timer.time)
+			for timer in due:
+				action=timer.action
+				if action is None:
+					#cancelled
+					continue
+				if timer.interval:
+					#the next repeat, timed from this one
+					timer.time+=timer.interval
+					timer.tick=self._tickOf(timer.time)
+					self._insert(timer)
+				else:
+					timer.action=None
+					self.pending-=1
+					timer.macro._done(timer)
+				action()
+			#actions can schedule more, which might already be due - so go round until there are none
 			
+	def _onEdge(self,friendlyButtonID,downNow,timeNow):
+		#actions due before this edge happen first (the sampler can deliver several edges per frame)
+		if self.pending:
+			self.advance(timeNow)
+		zeroIndexedButtonID=friendlyButtonID-1
+		if downNow:
+			for binding in self.pressBindings.get(zeroIndexedButtonID,()):
+				binding(timeNow)
+		else:
+			for macro in self.heldMacros[zeroIndexedButtonID][:]:
+				macro.cancel()
+				
+				
+class MacroTimer(object):
+	#one action waiting in a MacroScheduler - <action> is None once it has run or been cancelled
+	__slots__=('time','tick','action','interval','macro')
+	
+	def __init__(self,time,action,interval,macro):
+		self.time=time
+		self.tick=0
+		self.action=action
+		self.interval=interval	#for repeats, or None
+		self.macro=macro
+		
+		
+class Macro(object):
+	#A set of timed actions started together by a MacroScheduler, which can be cancelled together
+	
+	def __init__(self,scheduler,onCancel=None):
+		self.scheduler=scheduler
+		self.onCancel=onCancel
+		self.timers=[]
+		self.remaining=0
+		self.button=None	#the button whose release cancels it, if any
+		self.cancelled=False
+		
+	def running(self):
+		return self.remaining>0
+		
+	def cancel(self):
+		#stop any actions that haven't happened yet.  Returns whether there were any.
+		if not self.remaining:
+			return False
+		for timer in self.timers:
+			if timer.action is not None:
+				timer.action=None
+				self.scheduler.pending-=1
+		self.remaining=0
+		self.cancelled=True
+		self._forget()
+		if self.onCancel is not None:
+			self.onCancel()
+		return True
+		
+	def _add(self,timer):
+		self.timers.append(timer)
+		self.remaining+=1
+		
+	def _done(self,timer):
+		self.remaining-=1
+		if not self.remaining:
+			self._forget()
+			
+	def _forget(self):
+		if self.button is not None:
+			macros=self.scheduler.heldMacros[self.button.zeroIndexedButtonID]
+			if self in macros:
+				macros.remove(self)
+				
+				
+class Outputs(object):
+	#The state a script wants its outputs (keys, virtual joystick axes and buttons...) to be in.  Write the desired values every frame, as
+	#usual, and flush() once at the end of the frame: only the outputs whose value is different from what was last sent are passed on, all
+	#together in one batch, to the sink - so an idle frame does no output at all.  Axes are quantised first, so noise too small to matter
+	#doesn't count as a change.
+	#
+	#	outputs=namedcontrollers.Outputs(namedcontrollers.FunctionSink({
+	#		'roll': lambda value: setattr(vJoy[0],'x',value),
+	#		'alt': lambda down: keyboard.setKeyDown(Key.LeftAlt) if down else keyboard.setKeyUp(Key.LeftAlt),
+	#	}))
+	#	outputs.axis('roll',step=1,scale=16383)	#-1..1 -> whole numbers -16383..16383
+	#	outputs.key('alt')
+	#	...
+	#	outputs['roll']=stick.axes.x()
+	#	outputs['alt']=throttle.buttons.autopilot()
+	#	outputs.flush()
+	
+	def __init__(self,sink):
+		self.sink=sink
+		self.order={}	#name -> the order it was declared in, which is the order changes are sent in
+		self.quantisers={}	#name -> (scale, step) for axes
+		self.sent={}	#name -> the value last sent
+		self.changes={}	#name -> its value, for every output that's different from what was sent
+		self.flushes=0	#flush()es that sent anything
+		self.writes=0	#changes sent
+		
+	def axis(self,name,step=0.001,scale=None,initial=None):
+		#An output that's a number: values are multiplied by <scale> (if there is one) and then rounded to a multiple of <step>.
+		#With <initial>, that value is assumed to have been sent already, so setting it again sends nothing.
+		self._declare(name,initial)
+		self.quantisers[name]=(scale,step)
+		
+	def key(self,name,initial=False):
+		#an output that's up or down (any truthy value is down)
+		self._declare(name,initial)
+		
+	def _declare(self,name,initial):
+		self.order[name]=len(self.order)
+		self.sent[name]=initial
+		
+	def quantise(self,name,value):
+		quantiser=self.quantisers.get(name)
+		if quantiser is None:
+			return bool(value)
+		scale,step=quantiser
+		if scale is not None:
+			value*=scale
+		if isinstance(step,int):
+			return int(round(value/float(step)))*step
+		return round(value/step)*step
+		
+	def set(self,name,value):
+		if name not in self.order:
+			raise ValueError('there is no output called %r - declare it with axis() or key() first' % name)
+		value=self.quantise(name,value)
+		if value==self.sent[name]:
+			#back to what was sent, so there's nothing to send after all
+			self.changes.pop(name,None)
+		else:
+			self.changes[name]=value
+			
+	__setitem__=set
+	
+	def get(self,name):
+		#the value that will be sent (or was last sent), after quantising
+		if name in self.changes:
+			return self.changes[name]
+		return self.sent[name]
+		
+	__getitem__=get
+	
+	def flush(self):
+		#send everything that changed, and return how many there were
+		if not self.changes:
+			return 0
+		changes=sorted(self.changes.items(),key=lambda change: self.order[change[0]])
+		self.changes={}
+		self.sent.update(changes)
+		self.sink.write(changes)
+		self.flushes+=1
+		self.writes+=len(changes)
+		return len(changes)
+		
+	def resend(self):
+		#send every output's current value again at the next flush(), eg after whatever receives them has been restarted
+		for name in self.order:
+			self.changes[name]=self.get(name)
+			
+			
+class FunctionSink(object):
+	#An Outputs sink that calls a function for each output that changed: functions is {name: function(value)}
+	
+	def __init__(self,functions):
+		self.functions=functions
+		
+	def write(self,changes):
+		functions=self.functions
+		for name,value in changes:
+			functions[name](value)
+			
+			
+class RecordingSink(object):
+	#An Outputs sink that just keeps every batch it's given, for tests and headless runs.  With a clock, each batch is stored with the time.
+	
+	def __init__(self,clock=None):
+		self.clock=clock
+		self.batches=[]	#[(time or None, [(name, value), ...]), ...]
+		self.state={}	#name -> the latest value written
+		
+	def write(self,changes):
+		self.batches.append( (self.clock() if self.clock is not None else None,list(changes)) )
+		self.state.update(changes)
+		
+	def clear(self):
+		del self.batches[:]
+		
+		
+def _zeroIndexedButtonIDs(control):
+	if isinstance(control,NamedButton):
+		return (control.zeroIndexedButtonID,)
+	return tuple( zeroIndexedButtonID for zeroIndexedButtonID,bit in control.buttons )
+
+		
+def axisSource(definition):
+	#An axis can be defined as an attribute name ('zRotation'), a slider index (0), or a dict like {'axis':'x'} or {'slider':0}
+	if isinstance(definition,dict):
+		if 'slider' in definition:
+			return definition['slider']
+		return definition['axis']
+	return definition
+		
+
+class EventLog(object):
+	#A columnar, array-backed ring buffer shared by all the controls of one controller.
+	#Each control registers for a fixed-size segment of the columns, which is its own ring of rows - so the segment number plays the part of a control ID column.
+	#Each row is one edge: its event code, when it happened, and how long the state it ended had lasted (plus the dot/dash it was classified as, for releases).
+	#Rows are only ever overwritten in place, so nothing is allocated when an event is logged.
+	
+	RELEASE=0
+	PRESS=1
+	
+	def __init__(self,historyLength=20):
+		self.historyLength=historyLength
+		self.rowsPerControl=historyLength*2	#a press and a release for each item of history
+		
+		self.codes=array('b')
+		self.times=array('d')
+		self.durations=array('d')
+		self.marks=array('b')	#0 for a dot and 1 for a dash, on release rows
+		self.counts=array('l')	#how many events each control has logged, ever
+		
+	def register(self):
+		#allocate a new segment, and return its number
+		slot=len(self.counts)
+		rows=self.rowsPerControl
+		self.codes.extend([0]*rows)
+		self.times.extend([0.0]*rows)
+		self.durations.extend([0.0]*rows)
+		self.marks.extend([0]*rows)
+		self.counts.append(0)
+		return slot
+		
+	def append(self,slot,code,timeNow,duration,mark=0):
+		count=self.counts[slot]
+		row=slot*self.rowsPerControl + count%self.rowsPerControl
+		self.codes[row]=code
+		self.times[row]=timeNow
+		self.durations[row]=duration
+		self.marks[row]=mark
+		self.counts[slot]=count+1
+		
+	def length(self,slot):
+		return min(self.counts[slot],self.rowsPerControl)
+		
+	def bisect(self,slot,time):
+		#How many of a control's retained events happened at or before <time> - ie the index of the first one after it.
+		#Each control's events are in time order, so this is a binary search of its segment, done by the bisect module in at most two
+		#contiguous runs of the times column (the older part of the ring, then the newer) - so it stays cheap however long the history is.
+		count=self.counts[slot]
+		rows=self.rowsPerControl
+		base=slot*rows
+		if count<=rows:
+			return bisect.bisect_right(self.times,time,base,base+count)-base
+		wrap=count%rows	#the oldest row, and the number of rows that have wrapped round to the start of the segment
+		if wrap and self.times[base]<=time:
+			return bisect.bisect_right(self.times,time,base,base+wrap)-base + rows-wrap
+		return bisect.bisect_right(self.times,time,base+wrap,base+rows)-base-wrap
+		
+	def countCode(self,slot,start,code):
+		#how many of a control's retained events from index <start> onwards have event code <code> - presses and releases strictly alternate,
+		#so that's just half of them, give or take the newest
+		count=self.length(slot)-start
+		if count<=0:
+			return 0
+		if self.codes[self.row(slot,-1)]==code:
+			return (count+1)//2
+		return count//2
+		
+	def truncated(self,slot):
+		#True if some of a control's events have been overwritten
+		return self.counts[slot]>self.rowsPerControl
+		
+	def row(self,slot,index):
+		#the physical row of a control's <index>th retained event, oldest first (negative indexes count back from the newest)
+		count=self.counts[slot]
+		length=min(count,self.rowsPerControl)
+		if index<0:
+			index+=length
+		if not 0<=index<length:
+			raise IndexError('event log index out of range')
+		return slot*self.rowsPerControl + (count-length+index)%self.rowsPerControl
+	
+	
+class EventLogView(object):
+	#A read-only, list-like view of one control's events in the parent's EventLog - for example the times of its presses, or the durations of its releases.
+	#Indexing and len() work without copying anything out of the log.
+	__slots__=('eventLog','slot','field','code','states')
+	
+	def __init__(self,eventLog,slot,field,code=None,states=None):
+		self.eventLog=eventLog
+		self.slot=slot
+		self.field=field	#'log', 'history', 'times', 'durations', 'morse', 'morsePressTimes' or 'transitions'
+		self.code=code	#only show rows with this event code, or None for all rows
+		self.states=states	#for toggles and hats, the state that each code stands for
+		
+	def __len__(self):
+		length=self.eventLog.length(self.slot)
+		if self.code is None or length==0:
+			return length
+		#a control's presses and releases strictly alternate, so the rows with any one code are every other row
+		if self.eventLog.codes[self.eventLog.row(self.slot,-1)]==self.code:
+			return (length+1)//2
+		return length//2
+		
+	def __getitem__(self,index):
+		if isinstance(index,slice):
+			return [ self[i] for i in range(*index.indices(len(self))) ]
+		
+		eventLog=self.eventLog
+		if self.code is None:
+			row=eventLog.row(self.slot,index)
+		else:
+			length=len(self)
+			if index<0:
+				index+=length
+			if not 0<=index<length:
+				raise IndexError('event log index out of range')
+			#count back from the newest row with the right code
+			newest=-1 if eventLog.codes[eventLog.row(self.slot,-1)]==self.code else -2
+			row=eventLog.row(self.slot, newest-2*(length-1-index))
+		
+		return self._value(row)
+		
+	def _value(self,row):
+		eventLog=self.eventLog
+		field=self.field
+		if field=='times':
+			return eventLog.times[row]
+		if field=='durations':
+			return eventLog.durations[row]
+		if field=='log':
+			return (eventLog.codes[row], eventLog.times[row])
+		if field=='history':
+			#history records the state that just ended, rather than the one that just started
+			return (1-eventLog.codes[row], eventLog.durations[row])
+		if field=='morse':
+			return '.-'[eventLog.marks[row]]
+		if field=='morsePressTimes':
+			return eventLog.times[row]-eventLog.durations[row]
+		if field=='transitions':
+			#toggles and hats log the state they changed to as the code, and the state they changed from as the mark
+			return (self.states[eventLog.marks[row]], self.states[eventLog.codes[row]], eventLog.times[row])
+		raise ValueError('unknown event log field %r' % field)
+		
+	def __iter__(self):
+		#walk the segment's rows directly, rather than working out each one from scratch as indexing does
+		eventLog=self.eventLog
+		length=eventLog.length(self.slot)
+		if length==0:
+			return
+		rows=eventLog.rowsPerControl
+		base=self.slot*rows
+		oldest=eventLog.counts[self.slot]-length
+		start,step=0,1
+		if self.code is not None:
+			step=2
+			if eventLog.codes[base+oldest%rows]!=self.code:
+				start=1
+		value=self._value
+		for index in range(start,length,step):
+			yield value(base+(oldest+index)%rows)
+			
+	def __repr__(self):
+		return repr(list(self))
+		
 
 class ControlFactory(object):
 	
@@ -44,18 +2296,444 @@ class ControlFactory(object):
 		self.controlTypeDefinition=controlTypeDefinition #the definition for each controlType, as defined statically in the class itself
 		self.targetClassName=targetClassName #eg 'NamedButton'
 		
+		#Several names can refer to the same physical input (eg 'trigger', 'tg1' and 'guntrigger1' are all button 1).
+		#Every name is interned to a key for its physical input (by the compiled profile), so that all of its aliases share one control - and so one poll, and one history.
+		self.keysByName=parent.profile.keysByName[controlType]
+		self.namesByKey=parent.profile.namesByKey[controlType]	#the reverse index, physical input -> all of its names
+		self.controlsByKey={}
+		
 		
 	def __getattr__(self,name):
-
-		newControlClass = globals()[self.targetClassName]
-		#create the new control, setting its 'parent' attribute to be the same as this Factory's parent, ie the controller, and passing just the definition of this control into its constructor
 		
-		newControl = newControlClass(parent=self.parent, controller=self.parent.controller, controlType=self.controlType, definition=self.controlTypeDefinition[name], name=name)
+		if name not in self.keysByName:
+			raise AttributeError('%s has no %s called %r' % (self.parent.__class__.__name__, self.controlType, name))
+		
+		key=self.keysByName[name]
+		if key in self.controlsByKey:
+			#another name for a control we've already made
+			newControl=self.controlsByKey[key]
+		else:
+			newControlClass = globals()[self.targetClassName]
+			#create the new control, setting its 'parent' attribute to be the same as this Factory's parent, ie the controller, and passing just the definition of this control into its constructor
+			
+			newControl = newControlClass(parent=self.parent, controller=self.parent.controller, controlType=self.controlType, definition=self.controlTypeDefinition[name], name=name)
+			newControl.names=tuple(self.namesByKey[key])
+			self.controlsByKey[key]=newControl
+			if self.parent.instrumentation is not None:
+				self.parent.instrumentation.instrument(newControl)
 		
 		#Store the new control in self.<controlname> so that it only gets created once.
 		self.__dict__[name]=newControl
 		
 		return newControl
+		
+	def getNames(self,name):
+		#all the names that refer to the same physical input as <name>, for diagnostics
+		return tuple(self.namesByKey[self.keysByName[name]])
+		
+		
+def physicalInputKey(controlType,definition):
+	#A hashable key that is the same for every definition of the same physical input
+	if controlType=='axes':
+		#'x' and {'axis':'x'} are the same axis
+		if not isinstance(definition,dict):
+			source=axisSource(definition)
+			definition={'slider':source} if isinstance(source,int) else {'axis':source}
+	return _freeze(definition)
+	
+def _freeze(definition):
+	if isinstance(definition,dict):
+		return tuple(sorted( ((key,_freeze(value)) for key,value in definition.items()), key=lambda item: repr(item[0]) ))
+	if isinstance(definition,(list,tuple)):
+		return tuple( _freeze(value) for value in definition )
+	return definition
+
+def _checkCacheState(state,fields):
+	#a profile cache is only trusted to be what we wrote if it has exactly the expected fields, of the expected types
+	if not isinstance(state,dict) or set(state.keys())!=set(fields.keys()):
+		raise ValueError('the profile cache has the wrong fields')
+	for key,types in fields.items():
+		if not isinstance(state[key],types):
+			raise ValueError('the profile cache field %r is the wrong type' % key)
+
+class ProfileError(ValueError):
+	#Raised when a controller profile is invalid.  The message lists every problem that was found.
+	pass
+	
+	
+class CompiledProfile(object):
+	#Everything about a controller profile that can be worked out before a device is attached: validation, the snapshot layout,
+	#the alias maps, the toggle/button-hat lookup tables and the baked axis curves.
+	#It's built once per profile and shared by every controller that uses it (and for profile files, cached on disk), so treat it as read-only.
+	
+	def __init__(self,name,definitions,namingStrategies,defaultNamingStrategy,axisRange,path=None):
+		#problems are reported against <path>, for profiles loaded from a file, or else the profile's name
+		problems=validateProfile(definitions,namingStrategies,defaultNamingStrategy,axisRange)
+		if problems:
+			raise ProfileError('%s is not a valid controller profile:\n\t%s' % (path or name,'\n\t'.join(problems)))
+		
+		self.name=name
+		self.definitions=definitions
+		self.namingStrategies=namingStrategies
+		self.defaultNamingStrategy=defaultNamingStrategy
+		self.axisRange=tuple(axisRange)
+		
+		#the aliases: every name of each control type, interned to a key for its physical input, and the reverse index
+		self.keysByName={}
+		self.namesByKey={}
+		for controlType,controlTypeDefinition in definitions.items():
+			self.keysByName[controlType]={}
+			self.namesByKey[controlType]={}
+			for name in sorted(controlTypeDefinition.keys()):
+				key=physicalInputKey(controlType,controlTypeDefinition[name])
+				self.keysByName[controlType][name]=key
+				self.namesByKey[controlType].setdefault(key,[]).append(name)
+		
+		#every button that is referred to by a button, toggle or button-hat definition, and every POV
+		friendlyButtonIDs=set(definitions['buttons'].values())
+		groupDefinitions=list(definitions['toggles'].values())
+		povIndexes=set()
+		for definition in definitions['hats'].values():
+			if definition['type'].upper()=='POV':
+				povIndexes.add(definition['index'])
+			else:
+				groupDefinitions.append(definition['positions'])
+		for definition in groupDefinitions:
+			friendlyButtonIDs.update(definition.keys())
+		friendlyButtonIDs.discard(0)
+		
+		#(zeroIndexedButtonID, bit) pairs, so that poll() doesn't have to do any arithmetic
+		self.pollButtons=tuple( (friendlyButtonID-1, 1<<(friendlyButtonID-1)) for friendlyButtonID in sorted(friendlyButtonIDs) )
+		self.pollPOVs=tuple(sorted(povIndexes))
+		
+		#each distinct axis source (an attribute name like 'zRotation' or a slider index) gets one slot in the snapshot's axis values,
+		#however many names refer to it
+		self.axisSlots={}
+		for name,definition in sorted(definitions['axes'].items()):
+			source=axisSource(definition)
+			if source not in self.axisSlots:
+				self.axisSlots[source]=len(self.axisSlots)
+		self.pollAxes=tuple( (slot, source) for source,slot in sorted(self.axisSlots.items(), key=lambda item: item[1]) )
+		
+		#axes whose definitions include any shaping (deadzone, curve etc) get a pipeline, with its curve baked into a lookup table now.
+		#Each distinct pipeline writes its output into its own slot in the controller's shapedAxisValues, once per frame.
+		self.axisPipelines={}
+		for name,definition in sorted(definitions['axes'].items()):
+			if isinstance(definition,dict) and AxisPipeline.isShaped(definition):
+				key=physicalInputKey('axes',definition)
+				if key not in self.axisPipelines:
+					self.axisPipelines[key]=AxisPipeline(definition,axisRange,rawSlot=self.axisSlots[axisSource(definition)],shapedSlot=len(self.axisPipelines))
+		
+		#the lookup tables for every toggle and button hat, keyed by their definition
+		self.buttonGroups={}
+		for definition in groupDefinitions:
+			key=_freeze(definition)
+			if key not in self.buttonGroups:
+				self.buttonGroups[key]=compileButtonGroup(definition,namingStrategies,defaultNamingStrategy)
+		
+		#the integer states of every toggle and hat, and all of their names, keyed by their positions
+		self.stateTables={}
+		for positions in groupDefinitions+[ definition['positions'] for definition in definitions['hats'].values() if definition['type'].upper()=='POV' ]:
+			key=_freeze(positions)
+			if key not in self.stateTables:
+				self.stateTables[key]=compileStateTable(positions)
+				
+	def cacheState(self):
+		#everything compiled, as nothing but tuples, lists, dicts, numbers and strings - which marshal can store without being able to run anything
+		state=dict(self.__dict__)
+		state['axisPipelines']=dict( (key,pipeline.cacheState()) for key,pipeline in self.axisPipelines.items() )
+		return state
+		
+	@classmethod
+	def fromCacheState(cls,state):
+		#raises ValueError for anything that isn't exactly what cacheState() makes
+		_checkCacheState(state,{'name':_stringTypes, 'definitions':dict, 'namingStrategies':dict, 'defaultNamingStrategy':_stringTypes, 'axisRange':tuple,
+			'keysByName':dict, 'namesByKey':dict, 'pollButtons':tuple, 'pollPOVs':tuple, 'axisSlots':dict, 'pollAxes':tuple,
+			'axisPipelines':dict, 'buttonGroups':dict, 'stateTables':dict})
+		if validateProfile(state['definitions'],state['namingStrategies'],state['defaultNamingStrategy'],state['axisRange']):
+			raise ValueError('the cached profile is not a valid controller profile')
+		compiled=cls.__new__(cls)
+		for key,value in state.items():
+			setattr(compiled,key,value)
+		compiled.axisPipelines=dict( (key,AxisPipeline.fromCacheState(pipelineState)) for key,pipelineState in state['axisPipelines'].items() )
+		return compiled
+		
+	def controllerClass(self):
+		#a NamedController subclass for this profile, like WarthogThrottle
+		attributes=dict(self.definitions)
+		attributes.update(namingStrategies=self.namingStrategies,defaultNamingStrategy=self.defaultNamingStrategy,axisRange=self.axisRange,_compiledProfile=self)
+		return type(str(self.name),(NamedController,),attributes)
+		
+		
+def compileButtonGroup(definition,namingStrategies,defaultNamingStrategy):
+	#Only one state of a toggle or button hat can be 'on' at once, and the highest-numbered pressed button wins if the hardware reports more than one.
+	#Rather than working that out on every call, we build a mask over the group's buttons and, for every possible combination
+	#of those bits, precompute the resulting state - both as the raw button ID and as a name under each naming strategy.
+	#Resolving the group's state then becomes a single mask-and-lookup against the frame's button bits.
+	#Returns (buttons, mask, rawValues, namesByStrategy).
+	buttons=tuple( (friendlyButtonID-1, 1<<(friendlyButtonID-1)) for friendlyButtonID in sorted(definition.keys()) if friendlyButtonID!=0 )
+	mask=0
+	for zeroIndexedButtonID,bit in buttons:
+		mask|=bit
+	
+	rawValues={}
+	namesByIndex=dict( (namingIndex,{}) for namingIndex in namingStrategies.values() )
+	
+	maskedBits=mask
+	while True:
+		friendlyButtonID=0
+		for zeroIndexedButtonID,bit in buttons:
+			if maskedBits & bit:
+				friendlyButtonID=zeroIndexedButtonID+1
+		rawValues[maskedBits]=friendlyButtonID
+		
+		possibleReturnValues=definition[friendlyButtonID]
+		for namingIndex,names in namesByIndex.items():
+			if isinstance(possibleReturnValues,list):
+				names[maskedBits]=possibleReturnValues[namingIndex]
+			else:
+				#if not a list, the same name is used whatever the naming strategy
+				names[maskedBits]=possibleReturnValues
+		
+		if maskedBits==0:
+			break
+		#step through every subset of the mask
+		maskedBits=(maskedBits-1) & mask
+	
+	#a naming strategy can be asked for by name or by index (eg .apu('AUTHENTIC') or .apu(1)), or left blank to use the default
+	namesByStrategy={'':namesByIndex[namingStrategies[defaultNamingStrategy]]}
+	for namingStrategy,namingIndex in namingStrategies.items():
+		namesByStrategy[namingStrategy]=namesByIndex[namingIndex]
+		namesByStrategy[namingIndex]=namesByIndex[namingIndex]
+	
+	return buttons,mask,rawValues,namesByStrategy
+	
+	
+def compileStateTable(positions):
+	#The states of a toggle or hat, as sorted integers (button IDs or angles), each state's index (which is what its transition log stores),
+	#and every name of every state, in any naming strategy and in upper case too -> the state.
+	#Returns (states, stateIndexes, statesByName).
+	states=tuple(sorted(positions.keys()))
+	stateIndexes=dict( (state,index) for index,state in enumerate(states) )
+	statesByName={}
+	for state in states:
+		names=positions[state]
+		if not isinstance(names,list):
+			names=[names]
+		for name in names:
+			statesByName.setdefault(name,state)
+			statesByName.setdefault(str(name).upper(),state)
+	return states,stateIndexes,statesByName
+	
+	
+def validateProfile(definitions,namingStrategies,defaultNamingStrategy,axisRange):
+	#returns a list of everything that's wrong with a profile, so that mistakes show up when it's loaded rather than as a KeyError mid-flight
+	problems=[]
+	
+	if defaultNamingStrategy not in namingStrategies:
+		problems.append('default naming strategy %r is not one of the naming strategies %r' % (defaultNamingStrategy,sorted(namingStrategies)))
+	namesNeeded=max(namingStrategies.values())+1 if namingStrategies else 1
+	
+	def isButtonID(value):
+		return isinstance(value,int) and not isinstance(value,bool) and value>=1
+	
+	def checkButtonGroup(description,positions):
+		if not isinstance(positions,dict):
+			problems.append('%s must be a dict of button IDs to state names' % description)
+			return
+		if 0 not in positions:
+			problems.append("%s has no 0 state (the name to use when none of its buttons are pressed)" % description)
+		for friendlyButtonID,stateNames in positions.items():
+			if friendlyButtonID!=0 and not isButtonID(friendlyButtonID):
+				problems.append('%s has a state for %r, which is not a button ID' % (description,friendlyButtonID))
+			if isinstance(stateNames,list) and len(stateNames)<namesNeeded:
+				problems.append('%s state %r needs a name for each of the %d naming strategies' % (description,friendlyButtonID,namesNeeded))
+	
+	for name,friendlyButtonID in sorted(definitions['buttons'].items()):
+		if not isButtonID(friendlyButtonID):
+			problems.append('button %r has ID %r - button IDs are whole numbers from 1' % (name,friendlyButtonID))
+	
+	for name,positions in sorted(definitions['toggles'].items()):
+		checkButtonGroup('toggle %r' % name,positions)
+	
+	for name,definition in sorted(definitions['hats'].items()):
+		hatType=str(definition.get('type','')).upper()
+		if hatType=='POV':
+			index=definition.get('index')
+			if not isinstance(index,int) or index<0:
+				problems.append('POV hat %r needs an index of 0 or more, not %r' % (name,index))
+			positions=definition.get('positions',{})
+			if -1 not in positions:
+				problems.append("POV hat %r has no -1 position (the name to use when it's centred)" % name)
+			for angle in positions:
+				if not isinstance(angle,int) or not (angle==-1 or 0<=angle<36000):
+					problems.append('POV hat %r has a position at %r - POV angles are -1, or 0 to 35999 hundredths of a degree' % (name,angle))
+		elif hatType=='BUTTONS':
+			checkButtonGroup('button hat %r' % name,definition.get('positions'))
+		else:
+			problems.append("hat %r has type %r - it should be 'POV' or 'BUTTONS'" % (name,definition.get('type')))
+	
+	for name,definition in sorted(definitions['axes'].items()):
+		try:
+			source=axisSource(definition)
+			if not isinstance(source,(int,)+_stringTypes) or isinstance(source,bool):
+				raise ValueError('its source must be an axis name or a slider index, not %r' % (source,))
+			if isinstance(definition,dict) and AxisPipeline.isShaped(definition):
+				AxisPipeline(definition,axisRange)
+		except (ValueError,KeyError,TypeError) as error:
+			problems.append('axis %r: %s' % (name,error))
+	
+	return problems
+	
+	
+#Profile caches are a line of PROFILE_CACHE_MAGIC, a line of JSON saying what they were compiled from (and by), and then the compiled
+#profile as plain data in marshal format.  Bump PROFILE_CACHE_VERSION whenever the compiled form changes, so that stale caches are ignored.
+PROFILE_CACHE_MAGIC=b'namedcontrollers profile cache'
+PROFILE_CACHE_VERSION=3
+
+#Python 2 (and IronPython) reads the strings in JSON files as unicode
+try:
+	_stringTypes=(str,unicode)
+except NameError:
+	_stringTypes=(str,)
+try:
+	_numberTypes=(int,long,float)
+except NameError:
+	_numberTypes=(int,float)
+
+def _trustedCache(cachePath):
+	#only trust a cache that nobody else could have written: on systems with file owners, it must be ours and not writable by anyone else.
+	#(On Windows the folder's permissions have to be relied on instead.)
+	if not hasattr(os,'getuid'):
+		return True
+	info=os.stat(cachePath)
+	return info.st_uid==os.getuid() and not info.st_mode & (stat.S_IWGRP|stat.S_IWOTH)
+
+def loadProfile(path,cache=True):
+	#Load a controller profile from a JSON file, and return a NamedController class for it:
+	#	Throttle=namedcontrollers.loadProfile('my_throttle.json')
+	#	throttle=Throttle(joystick[2])
+	#The profile is validated and compiled the first time, and the compiled form is cached in <path>.cache and reused for as long as the file is unchanged
+	#(and only if the cache belongs to you, and nobody else can write to it).
+	with open(path,'rb') as profileFile:
+		source=profileFile.read()
+	sourceHash=hashlib.sha1(source).hexdigest()
+	cachePath=path+'.cache'
+	
+	#the cache is only used if its header matches this file and this Python, and even then it's only data - marshal can't run anything,
+	#and fromCacheState() only accepts the fields it expects
+	header=json.dumps({'version':PROFILE_CACHE_VERSION, 'sourceHash':sourceHash, 'python':list(sys.version_info[:2]), 'marshal':marshal.version},sort_keys=True).encode('utf-8')
+	if cache and os.path.exists(cachePath):
+		try:
+			if not _trustedCache(cachePath):
+				raise ValueError('%s could have been written by someone else' % cachePath)
+			with open(cachePath,'rb') as cacheFile:
+				if cacheFile.readline().rstrip(b'\n')==PROFILE_CACHE_MAGIC and cacheFile.readline().rstrip(b'\n')==header:
+					return CompiledProfile.fromCacheState(marshal.loads(cacheFile.read())).controllerClass()
+		except Exception:
+			#a cache we can't read is no worse than no cache
+			pass
+	
+	compiled=parseProfile(source,path)
+	
+	if cache:
+		try:
+			if os.path.exists(cachePath) and not _trustedCache(cachePath):
+				os.remove(cachePath)
+			#created writable only by us, whatever the umask, so that it will be trusted next time
+			with os.fdopen(os.open(cachePath,os.O_WRONLY|os.O_CREAT|os.O_TRUNC|getattr(os,'O_BINARY',0),0o644),'wb') as cacheFile:
+				cacheFile.write(PROFILE_CACHE_MAGIC+b'\n'+header+b'\n')
+				cacheFile.write(marshal.dumps(compiled.cacheState(),marshal.version))
+		except (IOError,OSError,ValueError):
+			#eg the profile is somewhere read-only, like Program Files
+			pass
+	
+	return compiled.controllerClass()
+	
+def parseProfile(source,path='profile'):
+	#Parse and compile the JSON text of a profile - see exportProfile() for the format.  Returns a CompiledProfile.
+	problems=[]
+	
+	def rejectDuplicateNames(pairs):
+		result={}
+		for key,value in pairs:
+			if key in result:
+				problems.append('%r is defined more than once' % key)
+			result[key]=value
+		return result
+	
+	def stateIDs(description,positions):
+		#JSON keys are always strings, but state IDs are numbers
+		result={}
+		for key,value in positions.items():
+			try:
+				stateID=int(key)
+			except ValueError:
+				problems.append('%s has a state for %r, which is not a number' % (description,key))
+				continue
+			if stateID in result:
+				problems.append('%s has more than one state for %d' % (description,stateID))
+			result[stateID]=value
+		return result
+	
+	try:
+		data=json.loads(source.decode('utf-8'),object_pairs_hook=rejectDuplicateNames)
+	except ValueError as error:
+		raise ProfileError('%s is not valid JSON: %s' % (path,error))
+	
+	definitions={}
+	for controlType in ('buttons','toggles','axes','hats'):
+		definitions[controlType]=dict(data.get(controlType,{}))
+	for name,positions in definitions['toggles'].items():
+		definitions['toggles'][name]=stateIDs('toggle %r' % name,positions)
+	for name,definition in definitions['hats'].items():
+		if isinstance(definition.get('positions'),dict):
+			definitions['hats'][name]=dict(definition,positions=stateIDs('hat %r' % name,definition['positions']))
+	
+	#"aliases": {"buttons": {"trigger": ["tg1", "guntrigger1"]}} gives the trigger button two more names
+	for controlType,aliases in data.get('aliases',{}).items():
+		if controlType not in definitions:
+			problems.append('aliases given for unknown control type %r' % controlType)
+			continue
+		for name,otherNames in aliases.items():
+			if name not in definitions[controlType]:
+				problems.append('aliases given for %s %r, which is not defined' % (controlType,name))
+				continue
+			for otherName in otherNames:
+				if otherName in definitions[controlType]:
+					problems.append('alias %r of %s %r is already defined' % (otherName,controlType,name))
+				definitions[controlType][otherName]=definitions[controlType][name]
+	
+	namingStrategies=data.get('namingStrategies',NamedController.namingStrategies)
+	defaultNamingStrategy=data.get('defaultNamingStrategy',NamedController.defaultNamingStrategy)
+	axisRange=tuple(data.get('axisRange',NamedController.axisRange))
+	
+	if problems:
+		#report everything at once, not just the problems with the file's structure
+		problems.extend(validateProfile(definitions,namingStrategies,defaultNamingStrategy,axisRange))
+		raise ProfileError('%s is not a valid controller profile:\n\t%s' % (path,'\n\t'.join(problems)))
+	
+	return CompiledProfile(str(data.get('name','Profile')),definitions,namingStrategies,defaultNamingStrategy,axisRange,path)
+		
+def exportProfile(controllerClass,path):
+	#Write a NamedController class's definitions out as a JSON profile file, as a starting point for your own:
+	#	namedcontrollers.exportProfile(namedcontrollers.WarthogThrottle,'my_throttle.json')
+	def jsonKeys(positions):
+		return dict( (str(key),value) for key,value in positions.items() )
+	
+	data={
+		'name': controllerClass.__name__,
+		'axisRange': list(controllerClass.axisRange),
+		'namingStrategies': controllerClass.namingStrategies,
+		'defaultNamingStrategy': controllerClass.defaultNamingStrategy,
+		'buttons': controllerClass.buttons,
+		'toggles': dict( (name,jsonKeys(positions)) for name,positions in controllerClass.toggles.items() ),
+		'axes': controllerClass.axes,
+		'hats': dict( (name,dict(definition,positions=jsonKeys(definition['positions']))) for name,definition in controllerClass.hats.items() ),
+	}
+	with open(path,'w') as profileFile:
+		json.dump(data,profileFile,indent=1,sort_keys=True)
+		
 
 class HatFactory(object):
 
@@ -70,22 +2748,28 @@ class HatFactory(object):
 
 			
 class NamedControl(object):
+	#Controls are flyweights: their attributes are fixed by __slots__ (so there's no per-control __dict__, and attribute access is quicker),
+	#and their definitions and lookup tables are the ones in the controller's compiled profile, shared by every controller of that class.
+	__slots__=('parent','controller','controlType','definition','name','names')
+	
 	def __init__(self,parent=None,controller=None, controlType='', definition='', name='',):
 		self.parent=parent
 		self.controller=controller 	#note that controller will usually be exactly the same as parent.controller, but this allows for some future flexibility
 		self.controlType=controlType #eg 'buttons'
 		self.definition=definition
 		self.name=name
+		self.names=(name,)	#all of its names - ControlFactory fills this in
 
 	
 class NamedButton(NamedControl):
 	friendlyClassName='button'
+	__slots__=('friendlyButtonID','zeroIndexedButtonID','bit',
+		'durationOfMostRecentPressedState','durationOfMostRecentReleasedState','duration','timePressed','timeReleased','timeStateChanged','timeNow','downPreviously',
+		'logSlot','log','history','pressTimesLog','pressDurationsLog','releaseDurationsLog','morseLog','morsePressTimes',
+		'morseMatcher','dashDuration','pressStats','releaseStats','adaptiveDash')
+	
 	def __init__(self,parent=None,controller=None,controlType='', definition='',name='',):
-		self.parent=parent
-		self.controller=controller
-		self.controlType=controlType
-		self.definition=definition
-		self.name=name
+		NamedControl.__init__(self,parent,controller,controlType,definition,name)
 		
 		#FIXME trap button name not found
 		self.friendlyButtonID=self.definition
@@ -94,12 +2778,7 @@ class NamedButton(NamedControl):
 		self.zeroIndexedButtonID=self.friendlyButtonID - 1
 		
 		
-		self.getPressed=functools.partial(controller.getPressed,self.zeroIndexedButtonID)
-		self.activatedOnce=self.getPressed
-		
-		self.getDown=functools.partial(controller.getDown,self.zeroIndexedButtonID)
-		self.down=self.getDown
-		self.activatedNow=self.getDown
+		self.bit=1<<self.zeroIndexedButtonID
 		
 		#populate the initial value of the button
 		self.durationOfMostRecentPressedState=0
@@ -109,23 +2788,32 @@ class NamedButton(NamedControl):
 		self.timeReleased=0
 		self.timeStateChanged=0
 		
-		#bad things will happen with stuff like checkMorseLog() if these numbers are too low!
-		logLength=20 #how many press/release timing data items to keep in the history
-		historyLength=20 #how many press/release timing data items to keep in the history
-		
-		self.log=collections.deque(maxlen=logLength)
-		self.history=collections.deque(maxlen=historyLength)
-		self.pressTimesLog=collections.deque(maxlen=logLength)
-		self.pressDurationsLog=collections.deque(maxlen=logLength)
-		self.releaseDurationsLog=collections.deque(maxlen=logLength)
-		self.morseLog=collections.deque(maxlen=logLength)
-		
-		self.timeNow=time.clock()
-		self.downPreviously=self.controller.getDown(self.zeroIndexedButtonID)
+		#the press/release history lives in the parent's shared EventLog - these are just views onto this button's part of it
+		eventLog=self.parent.eventLog
+		self.logSlot=eventLog.register()
+		self.log=EventLogView(eventLog,self.logSlot,'log')
+		self.history=EventLogView(eventLog,self.logSlot,'history')
+		self.pressTimesLog=EventLogView(eventLog,self.logSlot,'times',EventLog.PRESS)
+		self.pressDurationsLog=EventLogView(eventLog,self.logSlot,'durations',EventLog.RELEASE)
+		self.releaseDurationsLog=EventLogView(eventLog,self.logSlot,'durations',EventLog.PRESS)
+		self.morseLog=EventLogView(eventLog,self.logSlot,'morse',EventLog.RELEASE)
+		self.morsePressTimes=EventLogView(eventLog,self.logSlot,'morsePressTimes',EventLog.RELEASE) #the time each press in the morseLog started
+		self.morseMatcher=None	#made when the first pattern is registered - most buttons never have one
+		
+		self.timeNow=self.parent.now()
+		self.downPreviously=self._getRawCurrentValue()
 		downNow=self.downPreviously
 		
+		#from now on, the parent's edge engine keeps this button's timings up to date whenever poll() is called
+		self.parent._registerButton(self)
+		
 		self.dashDuration=0.5
 		
+		#running statistics over this button's press and release durations, for diagnostics and adaptive dot/dash classification
+		self.pressStats=DurationStats()
+		self.releaseStats=DurationStats()
+		self.adaptiveDash=False	#set to True to split dots from dashes where this button's presses naturally split, once there's a clear split
+		
 		
 		if downNow:
 			#button is held down at time of object initialisation
@@ -137,7 +2825,21 @@ class NamedButton(NamedControl):
 		
 		
 	def _getRawCurrentValue(self):
+		if self.parent.tickMode:
+			return self.parent.buttonBits & self.bit != 0
 		return self.controller.getDown(self.zeroIndexedButtonID)
+		
+	def getPressed(self):
+		if self.parent.tickMode:
+			#pressed in this frame's snapshot, but not in the previous one
+			return self.parent.pressedBits & self.bit != 0
+		return self.controller.getPressed(self.zeroIndexedButtonID)
+	activatedOnce=getPressed
+	
+	def getDown(self):
+		return self._getRawCurrentValue()
+	down=getDown
+	activatedNow=getDown
 	
 	def getTimeInCurrentState(self):
 		currentValue=self._getRawCurrentValue()
@@ -147,8 +2849,12 @@ class NamedButton(NamedControl):
 			
 		
 	def getValue(self):
+		if self.parent.tickMode:
+			#the parent's edge engine has already dealt with any press or release this frame
+			return self.parent.buttonBits & self.bit != 0
+		
 		downNow=self._getRawCurrentValue()
-		timeNow=time.clock()
+		timeNow=self.parent.now()
 		
 		if downNow and self.downPreviously:
 			#STILL_PRESSED
@@ -171,80 +2877,62 @@ class NamedButton(NamedControl):
 		return downNow
 
 		
-	def _writeToLog(self,event='',time=0.0):	#event=PRESS | RELEASE
-		if event.upper().startswith('P'):
-			eventCode=1
-			self.pressTimesLog.append(time)
-		else:
-			eventCode=0
-		self.log.append( (eventCode, time) )
-		
-	def _writeToHistory(self, event='', duration=0.0 ):
-		if event.upper().startswith('P'):
-			eventCode=1
-			self.pressDurationsLog.append(duration)
-		else:
-			eventCode=0
-			self.releaseDurationsLog.append(duration)
-		self.history.append( (eventCode, duration) )
-		
-	def _writeToMorseLog(self,duration=0.0):
-		if duration>self.dashDuration:
-			self.morseLog.append('-')
-		else:
-			self.morseLog.append('.')
+	def _writeToLog(self,eventCode,timeNow,duration,mark=0):
+		self.parent.eventLog.append(self.logSlot,eventCode,timeNow,duration,mark)
+		
+	def _classifyPress(self,duration=0.0):
+		#1 for a dash, 0 for a dot
+		if duration>self.getDashDuration():
+			return 1
+		return 0
+		
+	def getDashDuration(self):
+		#presses longer than this are dashes - dashDuration, unless adaptiveDash is on and the press durations have split into short and long
+		if self.adaptiveDash:
+			split=self.pressStats.split()
+			if split is not None:
+				return split
+		return self.dashDuration
 			
 	def printMorseLog(self):
-		result=''
-		for i in range(0, len(self.morseLog)):
-			result+=self.morseLog[i]
-			
-		return result
-			
+		return ''.join(self.morseLog)
+		
+	def registerMorse(self,pattern,window=10,callback=None):
+		#Register a dot/dash pattern to be matched as presses happen.  The whole pattern must be keyed within <window> seconds (0 for no limit).
+		#If given, callback(pattern) is called at the moment the pattern is completed.
+		if self.morseMatcher is None:
+			self.morseMatcher=MorseMatcher()
+		return self.morseMatcher.register(pattern,window,callback,zip(self.morseLog,self.morsePressTimes),self.parent.now())
 					
 	def checkMorseLog(self,message,duration=10,once=True):
-		messageLength=len(message)
-		if messageLength>len(self.morseLog):
-			return False
-			
-		for i in range(0,messageLength):
-			index=messageLength-i
-			if message[i] != self.morseLog[0-index]:
-				return False
-				
-		if duration:
-			#we need to check that the first press occurred no more than <duration> ago
-			relevantPressIndex=0-messageLength
-			relevantPressTime=self.pressTimesLog[relevantPressIndex]
-			timeNow=time.clock()
-			if timeNow-relevantPressTime > duration:
-				return False
-		
-		#We have a match
-		
-		if once:
-			#Prevent looping
-			self.morseLog[-1]='X'
-
-		return True
-			
+		#returns True if the most recent presses match message, and the first of them was no more than <duration> seconds ago.
+		#With once=True, each match is only reported once.
+		index=None
+		if self.morseMatcher is not None:
+			index=self.morseMatcher.patternIndexes.get( (message,duration) )
+		if index is None:
+			index=self.registerMorse(message,duration)
+		return self.morseMatcher.check(index,once,self.parent.now())
 		
 		
 	def _onPressed(self,timeNow):
 		self.timePressed=timeNow
 		self.timeStateChanged=timeNow
 		self.durationOfMostRecentReleasedState=timeNow-self.timeReleased
-		self._writeToLog('PRESS',timeNow)
-		self._writeToHistory('RELEASED',self.durationOfMostRecentReleasedState)
+		self._writeToLog(EventLog.PRESS,timeNow,self.durationOfMostRecentReleasedState)
+		self.releaseStats.add(self.durationOfMostRecentReleasedState)
 		
 		
 	def _onReleased(self,timeNow):
 		self.timeReleased=timeNow
 		self.timeStateChanged=timeNow
 		self.durationOfMostRecentPressedState=timeNow-self.timePressed
-		self._writeToLog('RELEASED',timeNow)
-		self._writeToHistory('PRESS',self.durationOfMostRecentPressedState)
-		self._writeToMorseLog(self.durationOfMostRecentPressedState)
+		#classify the press before it's added to the stats, so that an adaptive split only learns from presses it has already judged
+		mark=self._classifyPress(self.durationOfMostRecentPressedState)
+		self.pressStats.add(self.durationOfMostRecentPressedState)
+		self._writeToLog(EventLog.RELEASE,timeNow,self.durationOfMostRecentPressedState,mark)
+		if self.morseMatcher is not None:
+			self.morseMatcher.advance('.-'[mark],self.timePressed,timeNow)
 		
 	def getLog(self):
 		return self.log
@@ -265,18 +2953,18 @@ class NamedButton(NamedControl):
 			return False
 	
 	def getTimeSinceLastStateChange(self):
-		timeNow=time.clock()
+		timeNow=self.parent.now()
 		timeSinceLastStateChange=timeNow-self.timeStateChanged
 		
 		return timeSinceLastStateChange
 	
 	def getTimeSinceLastPress(self):
-		timeNow=time.clock()
+		timeNow=self.parent.now()
 		timeSinceLastPress=timeNow-self.timePressed
 		return timeSinceLastPress
 		
 	def getTimeSinceLastRelease(self):
-		timeNow=time.clock()
+		timeNow=self.parent.now()
 		timeSinceLastRelease=timeNow-self.timeReleased
 		return timeSinceLastRelease
 		
@@ -298,6 +2986,47 @@ class NamedButton(NamedControl):
 			return True
 		else:
 			return False
+			
+	#Queries over the recent history, which find where to start by binary search of the log's timestamps.
+	#They can only see as far back as the log goes, so raise historyLength if you ask about long windows.
+	
+	def countPresses(self,seconds):
+		#how many times the button has been pressed in the last <seconds> seconds
+		eventLog=self.parent.eventLog
+		return eventLog.countCode(self.logSlot,eventLog.bisect(self.logSlot,self.parent.now()-seconds),EventLog.PRESS)
+		
+	def countReleases(self,seconds):
+		eventLog=self.parent.eventLog
+		return eventLog.countCode(self.logSlot,eventLog.bisect(self.logSlot,self.parent.now()-seconds),EventLog.RELEASE)
+		
+	def pressesLongerThan(self,duration,seconds):
+		#the durations of the presses, released in the last <seconds> seconds, that lasted longer than <duration>, oldest first.
+		#eg len(button.pressesLongerThan(1,10))>=3 for three long presses in the last ten seconds
+		eventLog=self.parent.eventLog
+		slot=self.logSlot
+		codes=eventLog.codes
+		durations=eventLog.durations
+		result=[]
+		for index in range(eventLog.bisect(slot,self.parent.now()-seconds),eventLog.length(slot)):
+			row=eventLog.row(slot,index)
+			if codes[row]==EventLog.RELEASE and durations[row]>duration:
+				result.append(durations[row])
+		return result
+		
+	def stateAt(self,time):
+		#whether the button was down at <time> (as given by controller.now()), or None if that's further back than the log goes
+		eventLog=self.parent.eventLog
+		slot=self.logSlot
+		index=eventLog.bisect(slot,time)
+		if index:
+			return eventLog.codes[eventLog.row(slot,index-1)]==EventLog.PRESS
+		if eventLog.truncated(slot):
+			return None
+		if eventLog.length(slot)==0:
+			#it hasn't changed since it was created
+			return self.downPreviously
+		#before its first event, it was in the opposite state
+		return eventLog.codes[eventLog.row(slot,0)]==EventLog.RELEASE
 	
 	
 	
@@ -307,52 +3036,413 @@ class NamedButton(NamedControl):
 		
 
 
-class NamedButtonGroup(NamedControl):
-	friendlyClassName='buttongroup'
-	def __init__(self,parent=None,controller=None,controlType='', definition='', name='',):
-		self.parent=parent
-		self.controller=controller
-		self.controlType=controlType
-		self.definition=definition
-		self.name=name
+class DurationStats(object):
+	#Streaming statistics over a button's press (or release) durations, updated in constant time and space as each one ends:
+	#the running mean and variance (Welford), approximate percentiles (P-squared), and a split of the durations into short and long
+	#(a two-centroid online k-means, which slowly forgets, so that it follows a pilot's rhythm as it changes).
+	__slots__=('count','mean','sumOfSquares','minimum','maximum','trackedQuantiles','quantiles','forgetAfter','short','long','shortCount','longCount')
+	
+	def __init__(self,quantiles=(0.5,0.9),forgetAfter=32):
+		self.count=0
+		self.mean=0.0
+		self.sumOfSquares=0.0	#of the differences from the mean, for the variance
+		self.minimum=None
+		self.maximum=None
+		self.trackedQuantiles=quantiles
+		self.quantiles=None	#quantile -> P2Quantile, made with the first duration, since most buttons' stats are never used
+		self.forgetAfter=forgetAfter	#how many samples the short/long centroids remember, roughly
+		self.short=None	#the centroid of the short durations
+		self.long=None	#the centroid of the long durations
+		self.shortCount=0
+		self.longCount=0
+		
+	def add(self,duration):
+		self.count+=1
+		delta=duration-self.mean
+		self.mean+=delta/self.count
+		self.sumOfSquares+=delta*(duration-self.mean)
+		if self.minimum is None or duration<self.minimum:
+			self.minimum=duration
+		if self.maximum is None or duration>self.maximum:
+			self.maximum=duration
+		if self.quantiles is None:
+			self.quantiles=dict( (quantile,P2Quantile(quantile)) for quantile in self.trackedQuantiles )
+		for estimator in self.quantiles.values():
+			estimator.add(duration)
+		
+		if self.short is None:
+			self.short=self.long=duration
+		elif duration-self.short <= self.long-duration and (duration<self.long or self.short!=self.long):
+			self.shortCount+=1
+			self.short+=(duration-self.short)/min(self.shortCount,self.forgetAfter)
+		else:
+			self.longCount+=1
+			self.long+=(duration-self.long)/min(self.longCount,self.forgetAfter)
+			
+	def variance(self):
+		if self.count<2:
+			return 0.0
+		return self.sumOfSquares/(self.count-1)
+		
+	def standardDeviation(self):
+		return self.variance()**0.5
+		
+	def quantile(self,quantile):
+		#eg quantile(0.9) for the 90th percentile - only the quantiles given when these stats were made are tracked
+		if self.quantiles is None:
+			if quantile not in self.trackedQuantiles:
+				raise KeyError(quantile)
+			return 0.0
+		return self.quantiles[quantile].value()
+		
+	def split(self,separation=1.5):
+		#the duration halfway between the short and long centroids - or None if there's no clear split yet, ie unless
+		#both centroids have some durations and the long one is at least <separation> times the short one
+		if not (self.shortCount and self.longCount) or self.long < self.short*separation:
+			return None
+		return (self.short+self.long)/2.0
+		
+	def summary(self):
+		#a one-line summary, suitable for diagnostics.watch()
+		if not self.count:
+			return 'n=0'
+		result='n=%d mean=%.3f sd=%.3f min=%.3f max=%.3f' % (self.count,self.mean,self.standardDeviation(),self.minimum,self.maximum)
+		for quantile in sorted(self.trackedQuantiles):
+			result+=' p%g=%.3f' % (quantile*100,self.quantile(quantile))
+		split=self.split()
+		if split is not None:
+			result+=' split=%.3f (%.3f/%.3f)' % (split,self.short,self.long)
+		return result
 		
-		self.namingStrategies={'SIMPLE':0, 'AUTHENTIC':1}
-		self.defaultNamingStrategy='SIMPLE'
-		self.defaultNamingIndex=self.namingStrategies[self.defaultNamingStrategy]
 		
+class P2Quantile(object):
+	#An estimate of one quantile of a stream, from five markers, without storing the stream (Jain and Chlamtac's P-squared algorithm)
+	__slots__=('quantile','increments','count','heights','positions')
+	
+	incrementsByQuantile={}	#shared by every estimator of the same quantile
+	
+	def __init__(self,quantile):
+		self.quantile=quantile
+		if quantile not in self.incrementsByQuantile:
+			self.incrementsByQuantile[quantile]=(0.0,quantile/2.0,quantile,(1+quantile)/2.0,1.0)
+		#how far each marker's desired position moves per sample - so after n samples, marker i should be at 1+(n-1)*increments[i]
+		self.increments=self.incrementsByQuantile[quantile]
+		self.count=0
+		self.heights=[]	#the first five samples, and then the heights of the markers
+		self.positions=None
+		
+	def add(self,sample):
+		self.count+=1
+		heights=self.heights
+		if len(heights)<5:
+			heights.append(sample)
+			heights.sort()
+			if len(heights)==5:
+				self.positions=[1,2,3,4,5]
+			return
+		
+		#which cell the sample falls in, stretching the outer markers if it's outside them
+		if sample<heights[0]:
+			heights[0]=sample
+			cell=0
+		elif sample>=heights[4]:
+			heights[4]=sample
+			cell=3
+		else:
+			cell=0
+			while sample>=heights[cell+1]:
+				cell+=1
+		
+		positions=self.positions
+		for marker in range(cell+1,5):
+			positions[marker]+=1
+		
+		#move the middle markers towards where they should be, along a parabola through their neighbours if that keeps them in order
+		samples=self.count-1
+		for marker in (1,2,3):
+			offset=1+samples*self.increments[marker]-positions[marker]
+			if (offset>=1 and positions[marker+1]-positions[marker]>1) or (offset<=-1 and positions[marker-1]-positions[marker]<-1):
+				step=1 if offset>0 else -1
+				height=heights[marker] + step/float(positions[marker+1]-positions[marker-1]) * (
+					(positions[marker]-positions[marker-1]+step)*(heights[marker+1]-heights[marker])/float(positions[marker+1]-positions[marker]) +
+					(positions[marker+1]-positions[marker]-step)*(heights[marker]-heights[marker-1])/float(positions[marker]-positions[marker-1]) )
+				if not heights[marker-1]<height<heights[marker+1]:
+					height=heights[marker] + step*(heights[marker+step]-heights[marker])/float(positions[marker+step]-positions[marker])
+				heights[marker]=height
+				positions[marker]+=step
+				
+	def value(self):
+		heights=self.heights
+		if not heights:
+			return 0.0
+		if len(heights)<5:
+			#too few samples for the markers yet, so just use the nearest rank
+			return heights[min(int(self.quantile*len(heights)),len(heights)-1)]
+		return heights[2]
 		
-		#FIXME trap button name not found
 
-	def getRawValue(self):
-		
-		for friendlyButtonID in sorted(self.definition.keys(), reverse=True):
-			if friendlyButtonID!=0:
-				zeroIndexedButtonID=friendlyButtonID-1
-				if self.controller.getDown(zeroIndexedButtonID):
-					return friendlyButtonID
-						
-			else:
-				#if we've reached 0, none of the buttons defined as possible states for this toggle were pushed, so we can return the 'unpushed' state name
-				return 0
+class MorseMatcher(object):
+	#Matches any number of dot/dash patterns against a single button's presses, as they happen.
+	#All of the patterns are compiled into one automaton (Aho-Corasick, over the two symbols '.' and '-') which advances a single step per classified release.
+	#The cost of each release therefore doesn't depend on how many patterns are registered, and patterns that overlap don't interfere with each other.
 	
+	symbols={'.':0, '-':1}
 	
-	def getValue(self,namingStrategy=''):
-		if namingStrategy == '':
-			namingStrategy=self.defaultNamingStrategy
-			namingIndex=self.defaultNamingIndex
-		else:
-			namingIndex=self.namingStrategies[namingStrategy.upper()]
+	def __init__(self):
+		self.patterns=[]	#[(pattern, window, [callback, ...]), ...]
+		self.patternIndexes={}	#(pattern, window) -> index into self.patterns
+		self.lastMatchSymbolCount=[]	#the symbolCount at which each pattern last matched
+		self.lastMatchStartTime=[]	#the time the first press of that match started
+		self.reportedSymbolCount=[]	#the symbolCount at which each pattern's match was last reported by check(once=True)
+		self.symbolCount=0
+		self._compile()
+		self.pressTimes=collections.deque(maxlen=1)
+		
+	def register(self,pattern,window=10,callback=None,history=(),timeNow=0.0):
+		#history is the recent (symbol, pressTime) pairs, oldest first, so that a new pattern can pick up from where the button already is
+		for symbol in pattern:
+			if symbol not in self.symbols:
+				raise ValueError("Morse patterns can only contain '.' and '-', not %r" % symbol)
+		if not pattern:
+			raise ValueError("Morse patterns can't be empty")
+		
+		key=(pattern,window)
+		if key in self.patternIndexes:
+			#already registered (checkMorseLog() registers the patterns it's asked about) - it gets this callback too
+			index=self.patternIndexes[key]
+			if callback is not None:
+				self.patterns[index][2].append(callback)
+			return index
+		
+		index=len(self.patterns)
+		self.patterns.append( (pattern,window,[callback] if callback is not None else []) )
+		self.patternIndexes[key]=index
+		self.lastMatchSymbolCount.append(-1)
+		self.lastMatchStartTime.append(0.0)
+		self.reportedSymbolCount.append(-1)
+		self._compile()
+		
+		#replay the recent presses through the new automaton to find where we are now
+		self.pressTimes=collections.deque(maxlen=max( len(existingPattern) for existingPattern,existingWindow,existingCallbacks in self.patterns ))
+		for symbol,pressTime in history:
+			self.state=self.transitions[self.state][self.symbols[symbol]]
+			self.pressTimes.append(pressTime)
+		
+		#the new pattern may already be sitting at the end of the button's log
+		if index in self.outputs[self.state]:
+			self._recordMatch(index,timeNow)
+		
+		return index
+	
+	def _compile(self):
+		#build the trie of all the patterns...
+		goto=[{}]
+		outputs=[[]]
+		for index,(pattern,window,callbacks) in enumerate(self.patterns):
+			node=0
+			for symbol in pattern:
+				symbolIndex=self.symbols[symbol]
+				if symbolIndex not in goto[node]:
+					goto[node][symbolIndex]=len(goto)
+					goto.append({})
+					outputs.append([])
+				node=goto[node][symbolIndex]
+			outputs[node].append(index)
+		
+		#...then fill in the failure links breadth-first, so that every node has a direct transition for both symbols,
+		#and knows every pattern that ends there (including the shorter patterns that are a suffix of its own)
+		transitions=[ [0,0] for node in goto ]
+		fail=[0]*len(goto)
+		queue=collections.deque()
+		for symbolIndex in (0,1):
+			if symbolIndex in goto[0]:
+				child=goto[0][symbolIndex]
+				transitions[0][symbolIndex]=child
+				queue.append(child)
+		while queue:
+			node=queue.popleft()
+			outputs[node]=outputs[node]+outputs[fail[node]]
+			for symbolIndex in (0,1):
+				if symbolIndex in goto[node]:
+					child=goto[node][symbolIndex]
+					fail[child]=transitions[fail[node]][symbolIndex]
+					transitions[node][symbolIndex]=child
+					queue.append(child)
+				else:
+					transitions[node][symbolIndex]=transitions[fail[node]][symbolIndex]
+		
+		self.transitions=transitions
+		self.outputs=[ tuple(nodeOutputs) for nodeOutputs in outputs ]
+		self.state=0
+		
+	def advance(self,symbol,pressTime,timeNow):
+		self.symbolCount+=1
+		self.pressTimes.append(pressTime)
+		self.state=self.transitions[self.state][self.symbols[symbol]]
+		for index in self.outputs[self.state]:
+			self._recordMatch(index,timeNow)
+		
+	def _recordMatch(self,index,timeNow):
+		pattern,window,callbacks=self.patterns[index]
+		if len(pattern)>len(self.pressTimes):
+			return
+		startTime=self.pressTimes[-len(pattern)]
+		if window and timeNow-startTime > window:
+			return
+		self.lastMatchSymbolCount[index]=self.symbolCount
+		self.lastMatchStartTime[index]=startTime
+		for callback in callbacks:
+			callback(pattern)
+	
+	def check(self,index,once,timeNow):
+		#True if the pattern matches the most recent presses (and still fits in its window)
+		if self.lastMatchSymbolCount[index]!=self.symbolCount:
+			return False
+		window=self.patterns[index][1]
+		if window and timeNow-self.lastMatchStartTime[index] > window:
+			return False
+		if once:
+			if self.reportedSymbolCount[index]==self.symbolCount:
+				return False
+			self.reportedSymbolCount[index]=self.symbolCount
+		return True
+		
 
-		friendlyButtonID = self.getRawValue()
+class TrackedState(NamedControl):
+	#Change tracking for the controls that have several states - toggles and hats - kept up to date by poll().
+	#States are integers (the button ID of the active state for toggles and button hats, and the angle for POV hats),
+	#so noticing a particular change is an integer comparison rather than comparing names.
+	__slots__=('states','stateIndexes','statesByName','state','previousState','changedFrame','timeStateChanged','logSlot','transitionLog','stateDurationsLog')
+	
+	def _startTracking(self,positions):
+		#the states, their indexes and every name of every state come from the compiled profile - see compileStateTable()
+		self.states,self.stateIndexes,self.statesByName=self.parent.profile.stateTables[_freeze(positions)]
+		
+		self.state=self.getRawValue()
+		if self.state not in self.stateIndexes:
+			#a POV hat at an angle that isn't one of its positions starts off centred (-1, the lowest state)
+			self.state=self.states[0]
+		self.previousState=self.state
+		self.changedFrame=-1
+		self.timeStateChanged=self.parent.now()
+		
+		#each change is logged in the parent's EventLog, with the new state's index as its code and the old one's as its mark
+		eventLog=self.parent.eventLog
+		self.logSlot=eventLog.register()
+		self.transitionLog=EventLogView(eventLog,self.logSlot,'transitions',states=self.states)	#(fromState, toState, time) for each recent change
+		self.stateDurationsLog=EventLogView(eventLog,self.logSlot,'durations')	#how long the state that each change ended had lasted
+		
+		self.parent._registerTracked(self)
+		
+	def _changeState(self,state,timeNow):
+		self.parent.eventLog.append(self.logSlot,self.stateIndexes[state],timeNow,timeNow-self.timeStateChanged,self.stateIndexes[self.state])
+		self.previousState=self.state
+		self.state=state
+		self.changedFrame=self.parent.frame
+		self.timeStateChanged=timeNow
 		
-		possibleReturnValues=self.definition[friendlyButtonID]
-		if isinstance(possibleReturnValues,list):
-				
-			#FIXME check namingIndex is valid
-			return possibleReturnValues[namingIndex]
-		else:
-			#if not a list, just return the value.
-			return possibleReturnValues
+	def stateID(self,name):
+		#the integer state for a state name (or an integer state, unchanged) - look it up once and compare against .state and .previousState
+		if name in self.stateIndexes:
+			return name
+		try:
+			return self.statesByName[name]
+		except KeyError:
+			try:
+				return self.statesByName[name.upper()]
+			except (KeyError,AttributeError):
+				raise ValueError('%s has no state called %r' % (self.name,name))
+		
+	def changedThisFrame(self):
+		return self.changedFrame==self.parent.frame
+		
+	def changedTo(self,name):
+		#True in the frame that the control moved into state <name>
+		return self.changedFrame==self.parent.frame and self.state==self.stateID(name)
+		
+	def changedFrom(self,name):
+		#True in the frame that the control moved out of state <name>
+		return self.changedFrame==self.parent.frame and self.previousState==self.stateID(name)
+		
+	def getTimeSinceLastStateChange(self):
+		return self.parent.now()-self.timeStateChanged
+		
+	def getTimeInCurrentState(self):
+		return self.getTimeSinceLastStateChange()
+		
+	def getPreviousValue(self,namingStrategy=''):
+		#the name of the state before the most recent change
+		return self.stateName(self.previousState,namingStrategy)
+		
+	def countChanges(self,seconds):
+		#how many times the state has changed in the last <seconds> seconds
+		eventLog=self.parent.eventLog
+		return eventLog.length(self.logSlot)-eventLog.bisect(self.logSlot,self.parent.now()-seconds)
+		
+	def stateAt(self,time):
+		#the integer state at <time> (as given by controller.now()), found by binary search of the transition log - or None if that's further back than the log goes
+		eventLog=self.parent.eventLog
+		slot=self.logSlot
+		index=eventLog.bisect(slot,time)
+		if index:
+			return self.states[eventLog.codes[eventLog.row(slot,index-1)]]
+		if eventLog.truncated(slot):
+			return None
+		if eventLog.length(slot)==0:
+			return self.state
+		#before its first change, it was in the state that change was from
+		return self.states[eventLog.marks[eventLog.row(slot,0)]]
+		
+	def getValueAt(self,time,namingStrategy=''):
+		#the name of the state at <time>, or None if that's further back than the log goes
+		state=self.stateAt(time)
+		if state is None:
+			return None
+		return self.stateName(state,namingStrategy)
+		
+		
+class NamedButtonGroup(TrackedState):
+	friendlyClassName='buttongroup'
+	__slots__=('buttons','mask','rawValues','namesByStrategy')
+	
+	def __init__(self,parent=None,controller=None,controlType='', definition='', name='',):
+		NamedControl.__init__(self,parent,controller,controlType,definition,name)
+		
+		#FIXME trap button name not found
+		
+		#the mask over this group's buttons, and the tables from its masked bits to its state - see compileButtonGroup()
+		self.buttons,self.mask,self.rawValues,self.namesByStrategy=self.parent.profile.buttonGroups[_freeze(self.definition)]
+		
+		self._startTracking(self.definition)
+	
+	def _getMaskedBits(self):
+		if self.parent.tickMode:
+			return self.parent.buttonBits & self.mask
+		
+		getDown=self.controller.getDown
+		maskedBits=0
+		for zeroIndexedButtonID,bit in self.buttons:
+			if getDown(zeroIndexedButtonID):
+				maskedBits|=bit
+		return maskedBits
+	
+	def getRawValue(self):
+		return self.rawValues[self._getMaskedBits()]
+	
+	def getValue(self,namingStrategy=''):
+		try:
+			names=self.namesByStrategy[namingStrategy]
+		except KeyError:
+			names=self.namesByStrategy[namingStrategy.upper()]
+		return names[self._getMaskedBits()]
+		
+	def stateName(self,state,namingStrategy=''):
+		#state 0 is the group's bits all being clear, and any other state is its own button's bit being set
+		try:
+			names=self.namesByStrategy[namingStrategy]
+		except KeyError:
+			names=self.namesByStrategy[namingStrategy.upper()]
+		return names[1<<(state-1) if state else 0]
 						
 					
 	def __call__(self,namingStrategy=''):
@@ -364,69 +3454,259 @@ class NamedButtonGroup(NamedControl):
 class NamedAxis(NamedControl):
 
 	friendlyClassName='axis'
+	__slots__=('slider','sliderIndex','axisInternalName','slot','pipeline')
 	
 	def __init__(self,parent=None,controller=None, controlType='', definition='',name='',):
-		self.parent=parent
-		self.controller=controller
-		self.controlType=controlType
-		self.definition=definition
-		self.name=name
+		NamedControl.__init__(self,parent,controller,controlType,definition,name)
 		
 		#some controls that a user might consider to be an axis are in fact a 'slider'.  
 		#The NamedAxis class tries to abstract that away but needs to know which we're dealing with so as to be able to get the value of the 'axis' either way.
 		#If the definition maps the 'axis' name to a string, delegate to controller.<axisname>  and if it maps to an int, delegate to controller.sliders[<sliderIndex>]
 		
-		if isinstance(self.definition,int):
+		source=axisSource(self.definition)
+		if isinstance(source,int):
 			self.slider=True
-			self.sliderIndex = self.definition
+			self.sliderIndex = source
 		else:
-			self.axisInternalName = self.definition
+			self.axisInternalName = source
 			self.slider=False
-			
-	def getValue(self):
+		
+		#where this axis lives in the parent's per-frame snapshot
+		self.slot=self.parent.axisSlots[source]
+		
+		#if the definition asks for any shaping, this is the parent's pipeline for it
+		self.pipeline=self.parent.axisPipelines.get(physicalInputKey(self.controlType,self.definition))
+		
+	def getRawValue(self):
+		if self.parent.tickMode:
+			return self.parent.axisValues[self.slot]
 		if self.slider:
 			return self.controller.sliders[self.sliderIndex]
 		else:
 			return getattr(self.controller,self.axisInternalName)
+			
+	def getValue(self):
+		if self.pipeline is None:
+			return self.getRawValue()
+		if self.parent.tickMode:
+			return self.parent.shapedAxisValues[self.pipeline.shapedSlot]
+		if self.pipeline.smoothing:
+			#smoothing has to step once per frame, and without poll() there's no frame to step on - every read would smooth again
+			raise ValueError('axis %r is smoothed, so it needs poll() to be called each frame' % self.name)
+		return self.pipeline.process(self.getRawValue(),self.parent.now())
 		
 	
 	def __call__(self):
 		return self.getValue()
 		
+		
+class AxisPipeline(object):
+	#Turns a raw axis value into a shaped one: deadzone, saturation, response curve and inversion (all baked into a lookup table, indexed by the raw value),
+	#followed by optional smoothing and quantization (which have to be worked out each frame, because they depend on previous values).
+	#Axes come out in the range -1.0 to 1.0, or 0.0 to 1.0 if they are 'unipolar' (like a throttle).
+	#
+	#An axis definition like this uses a pipeline:
+	#	'left': {'axis':'zRotation', 'unipolar':True, 'deadzone':0.02, 'curve':('scurve',0.5), 'invert':True, 'smoothing':('ema',0.5), 'quantize':0.01}
+	#
+	#	deadzone:	the fraction of travel (either side of the centre, or at the bottom for unipolar axes) that reads as zero
+	#	saturation:	the fraction of travel at which the output reaches its maximum
+	#	curve:		('expo', k) or ('scurve', k), with k from 0 (linear) to 1 (fully curved)
+	#	invert:		True to reverse the axis
+	#	smoothing:	('ema', alpha) for an exponential moving average, or ('oneeuro', minCutoff, beta[, derivativeCutoff]) for a One Euro filter
+	#	quantize:	the size of the steps the output is rounded to
+	
+	stages=('unipolar','deadzone','saturation','curve','invert','smoothing','quantize')
+	
+	@classmethod
+	def isShaped(cls,definition):
+		for stage in cls.stages:
+			if stage in definition:
+				return True
+		return False
+	
+	def __init__(self,definition,axisRange=(-1000,1000),rawSlot=0,shapedSlot=0):
+		for key in definition:
+			if key not in ('axis','slider')+self.stages:
+				raise ValueError('unknown axis setting %r' % key)
+		self.rawSlot=rawSlot
+		self.shapedSlot=shapedSlot
+		
+		self.low,self.high=axisRange
+		self.maxIndex=self.high-self.low
+		self.unipolar=bool(definition.get('unipolar',False))
+		self.deadzone=float(definition.get('deadzone',0.0))
+		self.saturation=float(definition.get('saturation',1.0))
+		if not 0.0<=self.deadzone<self.saturation<=1.0:
+			raise ValueError('axis deadzone and saturation must satisfy 0 <= deadzone < saturation <= 1')
+		self.curve,self.curvature=definition.get('curve',('linear',0.0))
+		if self.curve not in ('linear','expo','scurve') or not 0.0<=self.curvature<=1.0:
+			raise ValueError('axis curve must be (\'expo\', k) or (\'scurve\', k) with 0 <= k <= 1')
+		self.invert=bool(definition.get('invert',False))
+		
+		self.lut=array('d',[ self._shape(raw) for raw in range(self.low,self.high+1) ])
+		
+		self.smoothing=tuple(definition.get('smoothing',()))
+		if self.smoothing and self.smoothing[0] not in ('ema','oneeuro'):
+			raise ValueError('axis smoothing must be (\'ema\', alpha) or (\'oneeuro\', minCutoff, beta[, derivativeCutoff])')
+		self.quantize=float(definition.get('quantize',0.0))
+		self.previousValue=None
+		self.previousDerivative=0.0
+		self.previousTime=0.0
+		
+		#axes with no smoothing or quantization never need more than the table lookup
+		if self.smoothing or self.quantize:
+			self.process=self._processFiltered
+		else:
+			self.process=self._lookUp
+		
+	def instance(self):
+		#a copy of this pipeline with its own smoothing state, sharing the same lookup table
+		pipeline=copy.copy(self)
+		pipeline.previousValue=None
+		pipeline.previousDerivative=0.0
+		pipeline.previousTime=0.0
+		return pipeline
+		
+	def __getstate__(self):
+		#process is a bound method, which is chosen again when the pipeline is copied or unpickled
+		state=self.__dict__.copy()
+		del state['process']
+		return state
+		
+	def __setstate__(self,state):
+		self.__dict__.update(state)
+		if self.smoothing or self.quantize:
+			self.process=self._processFiltered
+		else:
+			self.process=self._lookUp
+			
+	def cacheState(self):
+		#for CompiledProfile.cacheState() - the lookup table as a plain list
+		state=self.__getstate__()
+		state['lut']=state['lut'].tolist()
+		return state
+		
+	@classmethod
+	def fromCacheState(cls,state):
+		_checkCacheState(state,{'rawSlot':int, 'shapedSlot':int, 'low':int, 'high':int, 'maxIndex':int, 'unipolar':bool, 'deadzone':float, 'saturation':float,
+			'curve':_stringTypes, 'curvature':_numberTypes, 'invert':bool, 'lut':list, 'smoothing':tuple, 'quantize':float,
+			'previousValue':type(None), 'previousDerivative':float, 'previousTime':float})
+		if state['maxIndex']!=state['high']-state['low'] or len(state['lut'])!=state['maxIndex']+1:
+			raise ValueError('the cached axis lookup table is the wrong size')
+		pipeline=cls.__new__(cls)
+		state=dict(state)
+		state['lut']=array('d',state['lut'])
+		pipeline.__setstate__(state)
+		return pipeline
+		
+	def _shape(self,raw):
+		if self.unipolar:
+			value=(raw-self.low)/float(self.high-self.low)
+		else:
+			value=(raw-(self.low+self.high)/2.0)/((self.high-self.low)/2.0)
+		sign=-1.0 if value<0 else 1.0
+		magnitude=abs(value)
+		
+		if magnitude<=self.deadzone:
+			magnitude=0.0
+		else:
+			magnitude=min(1.0,(magnitude-self.deadzone)/(self.saturation-self.deadzone))
+		
+		if self.curve=='expo':
+			magnitude=(1-self.curvature)*magnitude + self.curvature*magnitude**3
+		elif self.curve=='scurve':
+			magnitude=(1-self.curvature)*magnitude + self.curvature*magnitude*magnitude*(3-2*magnitude)
+		
+		value=sign*magnitude
+		if self.invert:
+			value=1.0-value if self.unipolar else -value
+		return value
+		
+	def _lookUp(self,raw,timeNow=0.0):
+		index=int(raw)-self.low
+		if index<0:
+			index=0
+		elif index>self.maxIndex:
+			index=self.maxIndex
+		return self.lut[index]
+		
+	def _processFiltered(self,raw,timeNow=0.0):
+		value=self._lookUp(raw)
+		
+		if self.smoothing:
+			previousValue=self.previousValue
+			if previousValue is None:
+				self.previousTime=timeNow
+			elif self.smoothing[0]=='ema':
+				value=previousValue+self.smoothing[1]*(value-previousValue)
+			else:
+				timeElapsed=timeNow-self.previousTime
+				if timeElapsed>0:
+					minCutoff,beta=self.smoothing[1],self.smoothing[2]
+					derivativeCutoff=self.smoothing[3] if len(self.smoothing)>3 else 1.0
+					derivative=(value-previousValue)/timeElapsed
+					derivative=self.previousDerivative+self._oneEuroAlpha(derivativeCutoff,timeElapsed)*(derivative-self.previousDerivative)
+					cutoff=minCutoff+beta*abs(derivative)
+					value=previousValue+self._oneEuroAlpha(cutoff,timeElapsed)*(value-previousValue)
+					self.previousDerivative=derivative
+					self.previousTime=timeNow
+				else:
+					value=previousValue
+			self.previousValue=value
+			
+		if self.quantize:
+			value=round(value/self.quantize)*self.quantize
+		return value
+		
+	@staticmethod
+	def _oneEuroAlpha(cutoff,timeElapsed):
+		timeConstant=1.0/(2*3.141592653589793*cutoff)
+		return 1.0/(1.0+timeConstant/timeElapsed)
+		
 
-class NamedPOVHat(NamedControl):
+class NamedPOVHat(TrackedState):
 	friendlyClassName='hat'
+	__slots__=('index',)
+	
 	def __init__(self,parent=None,controller=None, controlType='', definition='', name='',):
-		self.parent=parent
-		self.controller=controller
-		self.controlType=controlType
-		self.definition=definition
-		self.name=name
+		NamedControl.__init__(self,parent,controller,controlType,definition,name)
 		
 		self.index=self.definition['index']
+		
+		self._startTracking(self.definition['positions'])
 
 	def getRawValue(self):
+		if self.parent.tickMode:
+			return self.parent.povValues[self.index]
 		return self.controller.pov[self.index]
 		
 	def getValue(self):
 		rawValue=self.getRawValue()
+		if rawValue not in self.stateIndexes:
+			#an angle that isn't one of the hat's positions is read the way poll() reads it - as the position the hat was last in,
+			#or centred if poll() isn't being used
+			rawValue=self.state if self.parent.tickMode else self.states[0]
 		namedValue=self.definition["positions"][rawValue]
 		return namedValue
 		
+	def stateName(self,state,namingStrategy=''):
+		return self.definition["positions"][state]
+		
 	def __call__(self):
 		return self.getValue()
 
 
-#Toggles and ButtonHats are subclases of a NamedButtonGroup. 
-#I might add extra features in future such as tracking changes over time - this is where they would be implemented
+#Toggles and ButtonHats are subclases of a NamedButtonGroup, which (like POV hats) keep track of their changes of state - see TrackedState
 class NamedToggle(NamedButtonGroup):
 	friendlyClassName='toggle'
+	__slots__=()
 			
 		
 #Hat switches are often implemented as a group of buttons of which only one can be pressed, 
 #rather than a degree-based hat control	- that is best represented as a ButtonGroup
 class NamedButtonHat(NamedButtonGroup):
 	friendlyClassName='hat'
+	__slots__=()
 		
 
 class WarthogThrottle(NamedController):
@@ -536,6 +3816,12 @@ class WarthogThrottle(NamedController):
 		'x': 'x',
 		'y': 'y',
 		'slider': 0, #use an integer to refer to a slider as an 'axis'
+		
+		#shaped versions of the above - these return -1.0 to 1.0 (or 0.0 to 1.0 for the throttles) instead of the raw value
+		'left_throttle': {'axis':'zRotation', 'unipolar':True, 'deadzone':0.01, 'saturation':0.99},
+		'right_throttle': {'axis':'z', 'unipolar':True, 'deadzone':0.01, 'saturation':0.99},
+		'nub_x': {'axis':'x', 'deadzone':0.1, 'curve':('expo',0.4)},
+		'nub_y': {'axis':'y', 'deadzone':0.1, 'curve':('expo',0.4)},
 	}
 		
 	hats={
@@ -671,6 +3957,10 @@ class WarthogStick(NamedController):
 	axes={
 		'x':{'axis':'x'},
 		'y':{'axis':'y'},
+		
+		#shaped versions of the above, returning -1.0 to 1.0
+		'roll':{'axis':'x', 'deadzone':0.02},
+		'pitch':{'axis':'y', 'deadzone':0.02},
 	}
 	
 	toggles={}